@@ -0,0 +1,71 @@
+"""Collapses runs of attack alerts about the same structure into one group per fight."""
+from datetime import timedelta
+
+# Attack alert typeIDs -> function returning what a notification of that type is about. Alerts of one type about the
+# same thing within the grouping window are announced together.
+ATTACK_TARGETS = {
+    75: lambda n: (n.body.get('moonID') or n.solar_system_id, n.body.get('typeID')),  # tower
+    77: lambda n: (n.solar_system_id, n.body.get('typeID')),  # station service
+    80: lambda n: (n.solar_system_id, n.body.get('stationID')),  # station
+    86: lambda n: (n.solar_system_id,),  # TCU
+    87: lambda n: (n.solar_system_id,),  # SBU
+    88: lambda n: (n.solar_system_id,),  # IHUB
+    93: lambda n: (n.body.get('planetID'),),  # POCO
+}
+
+
+class AlertGroup(object):
+    """A run of attack alerts of one type about one structure, oldest first."""
+    __slots__ = ('notifications',)
+
+    def __init__(self, notifications):
+        self.notifications = notifications
+
+    @property
+    def first(self):
+        return self.notifications[0]
+
+    @property
+    def last(self):
+        return self.notifications[-1]
+
+    @property
+    def type_id(self):
+        return self.last.type_id
+
+    def attackers(self):
+        """Returns the distinct (character, corp, alliance) ids of the attackers in the order they showed up."""
+        attackers = []
+        for notification in self.notifications:
+            attacker = (notification.aggressor_id, notification.aggressor_corp_id, notification.aggressor_alliance_id)
+            if attacker[0] is not None and attacker not in attackers:
+                attackers.append(attacker)
+        return attackers
+
+    def __len__(self):
+        return len(self.notifications)
+
+    def __repr__(self):
+        return '<AlertGroup of {count} type {type_id} from {first} to {last}>'.format(
+            count=len(self), type_id=self.type_id, first=self.first.timestamp, last=self.last.timestamp)
+
+
+def group_alerts(notifications, window=timedelta(minutes=15)):
+    """
+    Groups attack alerts of the same type about the same structure which were sent within `window` of the first alert
+    of their group. Returns a list of the AlertGroups holding more than one notification; alerts which didn't group with
+    any other, and notifications which aren't attack alerts, are left out.
+    """
+    open_groups = {}  # (type, target) -> AlertGroup still accepting alerts
+    groups = []
+    for notification in sorted(notifications, key=lambda n: (n.sent_date, n.id)):
+        target = ATTACK_TARGETS.get(notification.type_id)
+        if target is None or not isinstance(notification.body, dict):
+            continue
+        key = (notification.type_id,) + target(notification)
+        group = open_groups.get(key)
+        if group is None or notification.sent_date - group.first.sent_date > window:
+            group = open_groups[key] = AlertGroup([])
+            groups.append(group)
+        group.notifications.append(notification)
+    return [group for group in groups if len(group) > 1]
@@ -0,0 +1,134 @@
+"""
+Runs full notification cycles against a local FakeEveAPI and reports how long each stage took, how many notifications
+it got through per second and the process's peak memory use after it, so performance regressions show up before they're
+deployed:
+
+    python benchmark.py --sizes 10,1000,100000 --latency 0.0
+
+Names are cached in memory and the notifications recorded in the last stage are rolled back, so running a benchmark
+leaves sovbot.sqlite as it was. Rendering messages needs the SDE index built by update-sde.
+"""
+import argparse
+import resource
+import sys
+import time
+from datetime import timedelta
+from pony.orm import db_session, rollback
+from twisted.internet import reactor
+from twisted.internet.defer import maybeDeferred, succeed
+from eve_api import EveAPI
+from fake_api import FakeEveAPI, listen_fake_api
+from models import open_sovbot_db
+from notification_formatter import MESSAGE_SPECS
+from notification_set import NotificationSet
+
+
+class MemoryNameCache(object):
+    """A NameCache lookalike which keeps names in a dictionary instead of the database."""
+    def __init__(self):
+        self.names = {}
+
+    def lookup(self, ids):
+        ids = set(int(i) for i in ids)
+        found = dict((str(i), self.names[i]) for i in ids if i in self.names)
+        return found, set(i for i in ids if i not in self.names)
+
+    def store(self, names):
+        self.names.update((int(i), name) for i, name in names.iteritems())
+
+    def stats(self):
+        return {'cached': len(self.names)}
+
+
+class CycleBenchmark(object):
+    """Times one notifications cycle of `size` notifications, stage by stage."""
+    def __init__(self, size, latency=0.0, chunk_size=250, alert_group_window=timedelta(minutes=15)):
+        self.size = size
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.alert_group_window = alert_group_window
+        self.results = []  # (stage, seconds, peak RSS in KB)
+        self.notification_set = None
+        self.merged = None
+        self.messages = []
+
+    def run(self):
+        """Serves the notifications, runs the cycle against them and returns a Deferred firing with self."""
+        port = listen_fake_api(FakeEveAPI(self.size, self.latency))
+        api = EveAPI(timeout=600.0, chunk_size=self.chunk_size,
+                     root='http://127.0.0.1:{}'.format(port.getHost().port))
+        selected_types = dict((str(type_id), '') for type_id in MESSAGE_SPECS)
+        self.notification_set = NotificationSet(selected_types, 'benchmark', 'benchmark', api=api,
+                                                name_cache=MemoryNameCache())
+        d = succeed(None)
+        for stage, step in [('headers', self.notification_set.get_headers_xml),
+                            ('texts', self.notification_set.get_texts_xml),
+                            ('build', self.notification_set.build_notifications),
+                            ('merge', self._merge),
+                            ('aggregate', lambda: self.merged.aggregate_alerts(self.alert_group_window)),
+                            ('names', lambda: self.merged.fetch_character_names()),
+                            ('format', self._format),
+                            ('record', self._record)]:
+            d.addCallback(self._time, stage, step)
+
+        def clean_up(result):
+            d = api.close()
+            d.addCallback(lambda _: port.stopListening())
+            d.addCallback(lambda _: result)
+            return d
+
+        d.addBoth(clean_up)
+        d.addCallback(lambda _: self)
+        return d
+
+    def _time(self, _, stage, step):
+        start = time.time()
+
+        def done(result):
+            self.results.append((stage, time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+            return result
+
+        return maybeDeferred(step).addCallback(done)
+
+    def _merge(self):
+        self.merged = NotificationSet.merge([self.notification_set], {})
+
+    def _format(self):
+        self.messages = self.merged.get_messages()
+
+    def _record(self):
+        with db_session:
+            self.merged.mark_sent(notification for notification, message in self.messages)
+            rollback()
+
+    def report(self):
+        lines = ["{size} notifications, {selected} selected, {messages} messages:".format(
+            size=self.size, selected=len(self.notification_set._notifications), messages=len(self.messages))]
+        for stage, seconds, peak_rss in self.results:
+            lines.append("  {stage:<10} {seconds:9.3f}s {rate:>12} notifications/s  peak RSS {rss:8.1f} MB".format(
+                stage=stage, seconds=seconds, rate='{:.0f}'.format(self.size / seconds) if seconds else '-',
+                rss=peak_rss / 1024.0))
+        lines.append("  {stage:<10} {seconds:9.3f}s".format(stage='total', seconds=sum(r[1] for r in self.results)))
+        return '\n'.join(lines)
+
+
+def run_benchmarks(sizes, latency, chunk_size):
+    d = succeed(None)
+    for size in sizes:
+        d.addCallback(lambda _, size=size: CycleBenchmark(size, latency, chunk_size).run())
+        d.addCallback(lambda benchmark: sys.stdout.write(benchmark.report() + '\n'))
+    return d
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark notification cycles against a local fake Eve API.")
+    parser.add_argument('--sizes', default='10,1000,100000', help="comma separated numbers of notifications per cycle")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds the fake API holds back every response")
+    parser.add_argument('--chunk-size', type=int, default=250, help="IDs per NotificationTexts/CharacterName request")
+    args = parser.parse_args()
+
+    open_sovbot_db()
+    d = run_benchmarks([int(size) for size in args.sizes.split(',')], args.latency, args.chunk_size)
+    d.addErrback(lambda failure: sys.stderr.write(failure.getTraceback()))
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
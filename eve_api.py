@@ -0,0 +1,179 @@
+"""Non-blocking access to the Eve: Online XML API built on Twisted's Agent."""
+from urllib import urlencode
+from lxml import etree
+from twisted.internet import reactor
+from twisted.internet.defer import CancelledError, Deferred, DeferredSemaphore, gatherResults
+from twisted.internet.protocol import Protocol
+from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, HTTPConnectionPool, ResponseDone, readBody
+from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers
+
+API_ROOT = 'https://api.eveonline.com'
+
+
+class APITimeout(Exception):
+    """Raised when the Eve API doesn't answer a request within the configured timeout."""
+
+
+class APIError(Exception):
+    """Raised when the Eve API answers a request with an <error> document, e.g. for an expired key."""
+
+
+class RowStream(object):
+    """
+    Incrementally parses an Eve API document as it's fed to it. Every <row> element is passed to `on_row` as soon as
+    it has been read and is then thrown away, so memory use doesn't depend on how many rows the document holds. Once
+    closed, current_time, cached_until and error hold the document's timestamps and error message, if any.
+    """
+    def __init__(self, on_row):
+        self.on_row = on_row
+        self.rows = 0
+        self.bytes = 0
+        self.current_time = None
+        self.cached_until = None
+        self.error = None
+        self._parser = etree.XMLPullParser(events=('end',))
+
+    def feed(self, data):
+        self.bytes += len(data)
+        self._parser.feed(data)
+        self._handle_events()
+
+    def close(self):
+        self._parser.close()
+        self._handle_events()
+        return self
+
+    def _handle_events(self):
+        for event, element in self._parser.read_events():
+            if element.tag == 'row':
+                self.rows += 1
+                self.on_row(element)
+                element.clear()
+                # Drop the rows we've already handled, otherwise they'd pile up as empty elements under the rowset.
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            elif element.tag == 'currentTime':
+                self.current_time = element.text
+            elif element.tag == 'cachedUntil':
+                self.cached_until = element.text
+            elif element.tag == 'error':
+                self.error = '{code}: {message}'.format(code=element.get('code'), message=element.text)
+
+
+class _StreamingBodyProtocol(Protocol):
+    """Feeds a response body to a RowStream as it arrives."""
+    def __init__(self, stream, finished):
+        self.stream = stream
+        self.finished = finished
+        self.failure = None
+
+    def dataReceived(self, data):
+        if self.failure is not None:
+            return
+        try:
+            self.stream.feed(data)
+        except Exception:
+            self.failure = Failure()
+            self.transport.stopProducing()
+
+    def connectionLost(self, reason):
+        if self.finished.called:
+            return
+        if self.failure is not None:
+            self.finished.errback(self.failure)
+        elif reason.check(ResponseDone, PotentialDataLoss):
+            try:
+                self.finished.callback(self.stream.close())
+            except Exception:
+                self.finished.errback()
+        else:
+            self.finished.errback(reason)
+
+
+def _stream_body(response, stream):
+    protocol = _StreamingBodyProtocol(stream, None)
+    protocol.finished = Deferred(lambda d: protocol.transport.stopProducing())
+    response.deliverBody(protocol)
+    return protocol.finished
+
+
+class EveAPI(object):
+    """Issues Eve API requests over a persistent connection pool and returns Deferreds for the response bodies."""
+    def __init__(self, timeout=30.0, max_connections=4, chunk_size=250, root=API_ROOT, clock=reactor):
+        """
+        Creates a new client. Requests which haven't produced a complete response body after `timeout` seconds are
+        cancelled and fail with APITimeout, so a hung API can never hold up the notifications task indefinitely. At
+        most `max_connections` requests are in flight at once, later ones wait their turn. Pages which take a list of
+        IDs are requested `chunk_size` IDs at a time by get_chunked() and stream_chunked(). Requests go to `root`, which
+        can point at a local stand-in for the API such as fake_api.FakeEveAPI.
+        """
+        self.root = root
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.clock = clock
+        self.semaphore = DeferredSemaphore(max_connections)
+        self.pool = HTTPConnectionPool(clock, persistent=True)
+        self.pool.maxPersistentPerHost = max_connections
+        self.agent = Agent(clock, connectTimeout=timeout, pool=self.pool)
+
+    def get(self, path, params):
+        """Requests an API page, e.g. 'char/Notifications.xml.aspx', and returns a Deferred firing with its body."""
+        return self.semaphore.run(self._request, path, params, readBody)
+
+    def get_chunked(self, path, params, ids):
+        """
+        Requests a page which takes an IDs parameter once per chunk of `ids`, running the requests concurrently.
+        Returns a Deferred firing with the list of response bodies in chunk order, or failing if any chunk fails.
+        """
+        return gatherResults([self.get(path, chunk_params) for chunk_params in self._chunk_params(params, ids)],
+                             consumeErrors=True)
+
+    def stream(self, path, params, on_row):
+        """
+        Requests an API page and parses it as it arrives, calling `on_row` with each of its <row> elements. Returns a
+        Deferred firing with the closed RowStream, which has the document's timestamps and error message.
+        """
+        stream = RowStream(on_row)
+        return self.semaphore.run(self._request, path, params, lambda response: _stream_body(response, stream))
+
+    def stream_chunked(self, path, params, ids, on_row):
+        """
+        Streams a page which takes an IDs parameter once per chunk of `ids`, running the requests concurrently and
+        passing the rows of every chunk to `on_row`. Returns a Deferred firing with the list of closed RowStreams.
+        """
+        return gatherResults([self.stream(path, chunk_params, on_row) for chunk_params in self._chunk_params(params, ids)],
+                             consumeErrors=True)
+
+    def close(self):
+        """Closes any idle persistent connections. Returns a Deferred which fires once they're all gone."""
+        log.msg("Closing Eve API connection pool...")
+        return self.pool.closeCachedConnections()
+
+    def _chunk_params(self, params, ids):
+        ids = [str(i) for i in ids]
+        for start in xrange(0, len(ids), self.chunk_size):
+            chunk_params = dict(params)
+            chunk_params['IDs'] = ','.join(ids[start:start + self.chunk_size])
+            yield chunk_params
+
+    def _request(self, path, params, read):
+        uri = '{root}/{path}?{query}'.format(root=self.root, path=path, query=urlencode(params))
+        d = self.agent.request('GET', uri, Headers({'User-Agent': ['sovbot']}))
+        d.addCallback(read)
+        timeout_call = self.clock.callLater(self.timeout, d.cancel)
+
+        def cancel_timeout(result):
+            if timeout_call.active():
+                timeout_call.cancel()
+            return result
+
+        def translate_cancel(failure):
+            failure.trap(CancelledError)
+            raise APITimeout("No response from {path} after {timeout} seconds.".format(path=path, timeout=self.timeout))
+
+        d.addBoth(cancel_timeout)
+        d.addErrback(translate_cancel)
+        return d
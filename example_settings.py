@@ -1,12 +1,48 @@
 # copy this into a 'settings.py' file to configure the bot
 keyid = 'my eve api keyid'
 vcode = 'my eve api vcode'
+# To poll several API keys, list them here instead. Each key is polled on its own schedule and events reported to more
+# than one character are only announced once. character_id is only needed for keys with several characters.
+# api_keys = [{'keyid': 'first keyid', 'vcode': 'first vcode'},
+#             {'keyid': 'second keyid', 'vcode': 'second vcode', 'character_id': 'character id'}]
+key_parallelism = 4  # maximum number of API keys polled at once
 jid = 'my jid'
 password = 'my password'
 room = 'my room jid'
+# To announce notifications in several rooms, list them here instead of `room`. A room only gets the notifications
+# matching every filter it has: typeIDs, regions/constellations/systems (by name or id) and the alliances involved.
+# rooms = [{'room': 'everything@conference.example.com'},
+#          {'room': 'delve-attacks@conference.example.com', 'types': [75, 86, 87, 88], 'regions': ['Delve']},
+#          {'room': 'allies@conference.example.com', 'alliances': [99001861]}]
 nickname = 'my nickname'
 log_traffic = False
-task_interval = 1800.0  # 30 minutes
+task_interval = 1800.0  # 30 minutes, how often keys are polled when the API doesn't say how long it caches them
+poll_margin = 15.0  # seconds to wait past a key's cachedUntil time before polling it again
+poll_jitter = 60.0  # up to this many random seconds are added to each poll, so keys don't all poll at once
+api_root = 'https://api.eveonline.com'  # point this at a local fake_api.py server to try the bot offline
+api_timeout = 30.0  # seconds to wait for an Eve API response before giving up on the cycle
+api_parallelism = 4  # maximum number of Eve API requests in flight at once
+api_chunk_size = 250  # maximum number of IDs sent in one NotificationTexts or CharacterName request
+sqlite_journal_mode = 'WAL'  # journal mode for sovbot.sqlite, e.g. 'WAL' or 'DELETE'
+sqlite_synchronous = 'NORMAL'  # sync level for sovbot.sqlite: 'OFF', 'NORMAL' or 'FULL'
+body_decoder_threads = 4  # threads used to decode notification bodies when a cycle brings in a large batch
+workers = 0  # processes the keys are shared out between to fetch and decode notifications, 0 does it all in the bot
+name_cache_ttl = 604800.0  # seconds a character/corp/alliance name is trusted before it's fetched again (1 week)
+send_rate = 2.0  # messages per second sent to the room once a burst has used up send_burst
+send_burst = 5  # messages sent at once before send_rate kicks in
+send_batch_size = 1  # pack up to this many queued alerts into one multi-line message, 1 sends each on its own
+spool_path = 'sovbot.spool'  # holds messages until they're sent, relative to sovbot.py like sovbot.sqlite
+spool_sync_interval = 1.0  # seconds between fsyncs of sent messages' acknowledgements in the spool
+alert_group_window = 900.0  # seconds of attack alerts about one structure announced as one summary, 0 to announce each
+metrics_interval = 3600.0  # seconds between metrics summaries written to the log, 0 to turn them off
+metrics_port = None  # serve the metrics as JSON on http://127.0.0.1:<port>/, None to turn it off
+retention_days = 30  # days sent notifications are remembered, must be longer than the API keeps them. None keeps all
+retention_interval = 21600.0  # seconds between prunes of sent notifications older than retention_days (6 hours)
+seen_filter = True  # keep the ids of sent notifications in memory, so most checks don't need the database
+# Room commands: !check polls every key the API has something new for, !status reports how polling is going and
+# !lookup <name or id> searches the SDE.
+command_prefix = '!'
+log_payloads = 0.0  # fraction of notification bodies written to the log, e.g. 0.01 for one in a hundred
 
 # Reference: https://neweden-dev.com/Char/Notifications#Notification_Types
 # Keys must match notification typeIDs, values can be any short description you like, keeping in mind that they'll be
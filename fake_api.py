@@ -0,0 +1,140 @@
+"""
+A local stand-in for the parts of the Eve XML API the bot uses, serving synthetic notifications scaled up from the
+samples in docs/. Use it to run the bot or benchmark.py without touching api.eveonline.com:
+
+    python fake_api.py --notifications 1000 --latency 0.2 --port 8080
+
+and set api_root = 'http://127.0.0.1:8080' in settings.py.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+from xml.sax.saxutils import quoteattr
+from lxml import etree
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+from twisted.python import log
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+from notification_record import API_TIME_FORMAT
+
+DOCS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'docs')
+# Generated notificationIDs start here, well clear of the ids of real notifications.
+FIRST_ID = 900000000
+
+DOCUMENT = """<?xml version='1.0' encoding='UTF-8'?>
+<eveapi version="2">
+  <currentTime>{current_time}</currentTime>
+  <result>
+    <rowset name="{rowset}" key="{key}" columns="{columns}">
+{rows}
+    </rowset>
+  </result>
+  <cachedUntil>{cached_until}</cachedUntil>
+</eveapi>
+"""
+
+
+def _row(attributes, text=None):
+    row = '      <row {}'.format(' '.join('{}={}'.format(name, quoteattr(value)) for name, value in attributes))
+    if text is None:
+        return row + ' />'
+    return '{row}><![CDATA[{text}]]></row>'.format(row=row, text=text)
+
+
+class FakeEveAPI(Resource):
+    """
+    Serves char/Notifications.xml.aspx, char/NotificationTexts.xml.aspx and eve/CharacterName.xml.aspx for
+    `notifications` synthetic notifications. They repeat the rows of docs/sample_headers.xml over and over with fresh
+    notificationIDs, each round an hour older than the last, and reuse the bodies in docs/sample_texts.xml. Names not
+    in docs/sample_names.xml are made up. Every response is held back by `latency` seconds.
+    """
+    isLeaf = True
+
+    def __init__(self, notifications, latency=0.0, cache_time=timedelta(minutes=30), docs_path=DOCS_PATH, clock=reactor):
+        Resource.__init__(self)
+        self.latency = latency
+        self.cache_time = cache_time
+        self.clock = clock
+        self.pages = {'/char/Notifications.xml.aspx': self.render_headers,
+                      '/char/NotificationTexts.xml.aspx': self.render_texts,
+                      '/eve/CharacterName.xml.aspx': self.render_names}
+        headers = etree.parse(os.path.join(docs_path, 'sample_headers.xml')).iter('row')
+        sample_headers = [(row.attrib, datetime.strptime(row.get('sentDate'), API_TIME_FORMAT)) for row in headers]
+        sample_texts = dict((row.get('notificationID'), row.text)
+                            for row in etree.parse(os.path.join(docs_path, 'sample_texts.xml')).iter('row'))
+        self.names = dict((row.get('characterID'), row.get('name'))
+                          for row in etree.parse(os.path.join(docs_path, 'sample_names.xml')).iter('row'))
+        header_rows = []
+        self.texts = {}
+        for i in xrange(notifications):
+            attributes, sent_date = sample_headers[i % len(sample_headers)]
+            notification_id = str(FIRST_ID + i)
+            sent_date -= timedelta(hours=i // len(sample_headers))
+            header_rows.append(_row([('notificationID', notification_id),
+                                     ('typeID', attributes['typeID']),
+                                     ('senderID', attributes['senderID']),
+                                     ('senderName', attributes['senderName']),
+                                     ('sentDate', sent_date.strftime(API_TIME_FORMAT)),
+                                     ('read', attributes['read'])]))
+            text = sample_texts.get(attributes['notificationID'])
+            if text is not None:
+                self.texts[notification_id] = _row([('notificationID', notification_id)], text)
+        self.header_rows = '\n'.join(header_rows)
+
+    def render_GET(self, request):
+        page = self.pages.get(request.path)
+        if page is None:
+            request.setResponseCode(404)
+            return ''
+        request.setHeader('Content-Type', 'application/xml; charset=utf-8')
+        if not self.latency:
+            return page(request)
+
+        def respond():
+            request.write(page(request))
+            request.finish()
+
+        finished = []
+        request.notifyFinish().addErrback(finished.append)
+        d = deferLater(self.clock, self.latency, lambda: None if finished else respond())
+        d.addErrback(log.err)
+        return NOT_DONE_YET
+
+    def render_headers(self, request):
+        return self._document('notifications', 'notificationID',
+                              'notificationID,typeID,senderID,senderName,sentDate,read', self.header_rows)
+
+    def render_texts(self, request):
+        rows = [self.texts[i] for i in self._ids(request) if i in self.texts]
+        return self._document('notifications', 'notificationID', 'notificationID', '\n'.join(rows))
+
+    def render_names(self, request):
+        rows = [_row([('name', self.names.get(i, 'Pilot {}'.format(i))), ('characterID', i)]) for i in self._ids(request)]
+        return self._document('characters', 'characterID', 'name,characterID', '\n'.join(rows))
+
+    def _document(self, rowset, key, columns, rows):
+        now = datetime.utcnow()
+        return DOCUMENT.format(current_time=now.strftime(API_TIME_FORMAT), rowset=rowset, key=key, columns=columns,
+                               rows=rows, cached_until=(now + self.cache_time).strftime(API_TIME_FORMAT))
+
+    @staticmethod
+    def _ids(request):
+        return [i for i in request.args.get('IDs', [''])[0].split(',') if i]
+
+
+def listen_fake_api(resource, port=0, interface='127.0.0.1', reactor=reactor):
+    """Serves a FakeEveAPI on a local port, by default any free one. Returns the listening port."""
+    return reactor.listenTCP(port, Site(resource), interface=interface)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve synthetic Eve API notifications for offline testing.")
+    parser.add_argument('--notifications', type=int, default=1000, help="number of notification headers to serve")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds to hold back every response")
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    log.startLogging(sys.stdout)
+    listen_fake_api(FakeEveAPI(args.notifications, args.latency), args.port)
+    reactor.run()
@@ -0,0 +1,183 @@
+"""Counters and histograms describing what the bot has been doing, logged periodically and optionally served as JSON."""
+import json
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from twisted.internet import reactor
+from twisted.internet.defer import maybeDeferred
+from twisted.internet.task import LoopingCall
+from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+# Bucket upper bounds for stage latencies in seconds, and for response sizes in bytes.
+LATENCY_BOUNDS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BOUNDS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+
+class Histogram(object):
+    """Counts observations into buckets by upper bound, with an overflow bucket for anything above the last bound."""
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the q-th quantile, or the largest observation if it overflowed."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.quantile(0.5),
+                'p95': self.quantile(0.95),
+                'max': self.max,
+                'buckets': dict(zip([str(bound) for bound in self.bounds] + ['inf'], self.buckets))}
+
+
+class Metrics(object):
+    """
+    A registry of named counters, histograms and gauges. Gauges are functions called whenever a snapshot is taken, e.g.
+    to read the hit rates of the caches without them knowing about metrics.
+    """
+    def __init__(self, clock=reactor):
+        self.clock = clock
+        self.started = clock.seconds()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._report_call = None
+
+    def increment(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value, bounds=LATENCY_BOUNDS):
+        """Adds an observation to the named histogram, creating it with `bounds` the first time it's used."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(bounds)
+        histogram.observe(value)
+
+    def gauge(self, name, read):
+        """Registers a function whose result is included in every snapshot under `name`."""
+        self.gauges[name] = read
+
+    def time(self, name, f, *args, **kwargs):
+        """
+        Calls f, which may return a Deferred, and records how long its result took in the named histogram. Failures
+        are counted under '<name>.errors' and passed on. Returns a Deferred with f's result.
+        """
+        start = self.clock.seconds()
+
+        def done(result):
+            self.observe(name, self.clock.seconds() - start)
+            if isinstance(result, Failure):
+                self.increment(name + '.errors')
+            return result
+
+        return maybeDeferred(f, *args, **kwargs).addBoth(done)
+
+    def snapshot(self):
+        """Returns every metric as a dictionary which can be serialized as JSON."""
+        gauges = {}
+        for name, read in self.gauges.iteritems():
+            try:
+                gauges[name] = read()
+            except Exception:
+                log.err(None, "Reading gauge {} failed".format(name))
+        return {'uptime': self.clock.seconds() - self.started,
+                'counters': dict(self.counters),
+                'histograms': {name: histogram.summary() for name, histogram in self.histograms.iteritems()},
+                'gauges': gauges}
+
+    def start_reporting(self, interval):
+        """Logs a one line summary of the metrics every `interval` seconds until stop_reporting() is called."""
+        if self._report_call is None:
+            self._report_call = LoopingCall(self.report)
+            self._report_call.clock = self.clock
+            self._report_call.start(interval, now=False)
+
+    def stop_reporting(self):
+        if self._report_call is not None and self._report_call.running:
+            self._report_call.stop()
+        self._report_call = None
+
+    def report(self):
+        snapshot = self.snapshot()
+        histograms = ', '.join('{name} n={count} mean={mean:.3f} p95={p95}'.format(name=name, **summary)
+                               for name, summary in sorted(snapshot['histograms'].iteritems()) if summary['count'])
+        log.msg("Metrics: {histograms}; counters: {counters}; gauges: {gauges}".format(
+            histograms=histograms or 'nothing timed yet', counters=json.dumps(snapshot['counters'], sort_keys=True),
+            gauges=json.dumps(snapshot['gauges'], sort_keys=True)))
+
+
+class StartupProfile(object):
+    """
+    How long each phase of starting up took, counting from `started`, e.g. when sovbot.py began its imports. Phases
+    run in order. They're timed with `with profile.phase(name):`, or marked once they're over with mark(name), which
+    counts from the end of the previous phase. Use mark() for work done before the profile existed, like imports, and
+    for milestones reached asynchronously, like joining the rooms.
+    """
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.time()
+        self.phases = []  # (name, seconds)
+        self._last = self.started
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._add(name, start)
+
+    def mark(self, name):
+        self._add(name, self._last)
+
+    def snapshot(self):
+        return {'total': self._last - self.started, 'phases': [[name, seconds] for name, seconds in self.phases]}
+
+    def report(self):
+        phases = ', '.join('{name} {seconds:.3f}s'.format(name=name, seconds=seconds) for name, seconds in self.phases)
+        log.msg("Startup took {total:.3f}s: {phases}.".format(total=self._last - self.started, phases=phases))
+
+    def _add(self, name, start):
+        now = time.time()
+        self.phases.append((name, now - start))
+        self._last = now
+
+
+class MetricsResource(Resource):
+    """Serves a snapshot of the metrics as JSON."""
+    isLeaf = True
+
+    def __init__(self, metrics):
+        Resource.__init__(self)
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps(self.metrics.snapshot(), sort_keys=True, indent=2)
+
+
+def listen_metrics(metrics, port, interface='127.0.0.1', reactor=reactor):
+    """Serves the metrics over HTTP on the given local port. Returns the listening port."""
+    log.msg("Serving metrics on http://{interface}:{port}/".format(interface=interface, port=port))
+    return reactor.listenTCP(port, Site(MetricsResource(metrics)), interface=interface)
@@ -1,11 +1,92 @@
 import os
+import sqlite3
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from heapq import merge
 from pony.orm import *
+from pony.orm.dbproviders.sqlite import SQLitePool, SQLiteProvider
+from notification_record import API_TIME_FORMAT
+from sde_index import SDEIndex
 
 ###############
 # Sovbot Data #
 ###############
 database_path = os.path.join(os.path.dirname(__file__), 'sovbot.sqlite')
-sovbot_db = Database("sqlite", database_path, create_db=True)
+# Bound and mapped by open_sovbot_db(), which has to be called before the models are used.
+sovbot_db = Database()
+# The synchronous level given to configure_sovbot_db(), applied to each of Pony's connections as it's handed out.
+_synchronous = None
+
+
+class _TunedSQLitePool(SQLitePool):
+    """
+    Pony's per-thread SQLite connection pool, which also applies the synchronous level to the connection. Pony asks the
+    pool for its connection at the start of every db_session, before it begins a transaction, which is the only time
+    SQLite lets the level be changed. The level only lasts as long as a connection, and Pony keeps one per thread, so
+    work run with deferToThread gets it too.
+    """
+    tuned = None  # (connection, level) last applied on this thread
+
+    def connect(pool):
+        con = SQLitePool.connect(pool)
+        if _synchronous is not None and pool.tuned != (con, _synchronous):
+            con.execute('PRAGMA synchronous = {}'.format(_synchronous))
+            pool.tuned = (con, _synchronous)
+        return con
+
+
+class _TunedSQLiteProvider(SQLiteProvider):
+    def get_pool(provider, filename, create_db=False):
+        return _TunedSQLitePool(os.path.abspath(filename), create_db)
+
+
+class SeenIds(object):
+    """
+    An in-memory copy of the ids in the Notification table, so checking ids which were already sent, which is most
+    of the ids in every cycle, doesn't touch the database. It isn't used until load() is called, after which it's kept
+    up to date as notifications are recorded and pruned, so it only ever holds the ids inside the retention horizon.
+    Ids it doesn't hold are still checked against the database, in case something else recorded them.
+
+    The ids are kept in a sorted array of machine ints searched by bisection, a few bytes per id where a set of ints
+    takes over 40. It's exact, unlike a Bloom filter, since the common case is confirming an id was sent and a false
+    positive would drop an alert. Ids added since the array was last built wait in a set of up to `merge_after` ids.
+    """
+    def __init__(self, merge_after=1000):
+        self.loaded = False
+        self.merge_after = merge_after
+        self._ids = array('l')
+        self._added = set()
+
+    def load(self, ids):
+        self._ids = array('l', sorted(set(ids)))
+        self._added = set()
+        self.loaded = True
+
+    def add(self, ids):
+        if self.loaded:
+            self._added.update(i for i in ids if i not in self)
+            if len(self._added) > self.merge_after:
+                self._ids = array('l', merge(self._ids, sorted(self._added)))
+                self._added = set()
+
+    def discard(self, ids):
+        ids = set(ids)
+        if ids:
+            self._added.difference_update(ids)
+            self._ids = array('l', (i for i in self._ids if i not in ids))
+
+    def __contains__(self, notification_id):
+        if notification_id in self._added:
+            return True
+        position = bisect_left(self._ids, notification_id)
+        return position < len(self._ids) and self._ids[position] == notification_id
+
+    def __len__(self):
+        return len(self._ids) + len(self._added)
+
+seen_ids = SeenIds()
+
 
 class Notification(sovbot_db.Entity):
     """Pony ORM model for Notification Headers"""
@@ -13,44 +94,127 @@ class Notification(sovbot_db.Entity):
     type_id = Required(int)
     sent_date = Required(unicode)
 
-sovbot_db.generate_mapping(create_tables=True)
+    @classmethod
+    @db_session
+    def new_ids(cls, notification_ids, chunk_size=500):
+        """
+        Returns the set of notification ids (as ints) from the given iterable which haven't been recorded yet. Ids are
+        checked with one query per `chunk_size` ids, which keeps us under SQLite's bound parameter limit. Ids held by
+        seen_ids aren't checked at all.
+        """
+        ids = [i for i in set(int(notification_id) for notification_id in notification_ids) if i not in seen_ids]
+        recorded_ids = set()
+        for start in xrange(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            recorded_ids.update(select(n.id for n in cls if n.id in chunk))
+        seen_ids.add(recorded_ids)
+        return set(ids) - recorded_ids
+
+    @classmethod
+    def record_sent(cls, notifications):
+        """
+        Records a batch of sent NotificationRecords in a single transaction. Notifications which were already recorded
+        are skipped.
+        """
+        notifications = list(notifications)
+        cls._record_sent(notifications)
+        # Only once the transaction has been committed, otherwise a failed commit would hide unsent notifications.
+        seen_ids.add(notification.id for notification in notifications)
+
+    @classmethod
+    @db_session
+    def _record_sent(cls, notifications):
+        new_ids = cls.new_ids(notification.id for notification in notifications)
+        for notification in notifications:
+            if notification.id in new_ids:
+                cls(id=notification.id, type_id=notification.type_id, sent_date=unicode(notification.timestamp))
+                new_ids.discard(notification.id)
+
+    @classmethod
+    @db_session
+    def prune(cls, horizon, now=None):
+        """
+        Deletes the notifications sent more than `horizon`, a timedelta, before `now` (UTC). The horizon has to be
+        longer than the API keeps notifications for, or pruned notifications would be announced again. Returns the
+        number of notifications deleted.
+        """
+        cutoff = unicode(((now or datetime.utcnow()) - horizon).strftime(API_TIME_FORMAT))
+        pruned_ids = select(n.id for n in cls if n.sent_date < cutoff)[:]
+        if pruned_ids:
+            # sent_date is stored in the API's time format, which sorts the same way as the times themselves.
+            sovbot_db.execute('DELETE FROM "Notification" WHERE "sent_date" < $cutoff')
+        seen_ids.discard(pruned_ids)
+        return len(pruned_ids)
+
+    @classmethod
+    @db_session
+    def load_seen_ids(cls):
+        """Fills seen_ids from the table, after which most checks for new ids are answered without the database."""
+        seen_ids.load(select(n.id for n in cls)[:])
+        return len(seen_ids)
+
+
+class CharacterName(sovbot_db.Entity):
+    """Pony ORM model for cached character, corporation and alliance names"""
+    id = PrimaryKey(int, auto=False)
+    name = Required(unicode)
+    fetched = Required(datetime)
 
 
-######################################
-# Mappings to Eve Static Data Export #
-######################################
-eve_sde = Database()
-eve_sde.bind('sqlite', os.path.join(os.path.dirname(__file__), 'sqlite-latest.sqlite'))
+def open_sovbot_db(path=None):
+    """
+    Binds the models to sovbot.sqlite, or to the database at `path`, creating the file and its tables if needed.
+    Calling it again does nothing.
+    """
+    global database_path
+    if sovbot_db.provider is None:
+        database_path = path or database_path
+        sovbot_db.bind(_TunedSQLiteProvider, database_path, create_db=True)
+        sovbot_db.generate_mapping(create_tables=True)
 
-class InvTypes(eve_sde.Entity):
-    _table_ = 'invTypes'
-    typeID = PrimaryKey(int)
-    typeName = Required(unicode)
 
-class MapSolarSystems(eve_sde.Entity):
-    _table_ = 'mapSolarSystems'
-    solarSystemID = PrimaryKey(int)
-    solarSystemName = Required(unicode)
+def configure_sovbot_db(journal_mode='WAL', synchronous='NORMAL'):
+    """
+    Tunes the sovbot database. The journal mode is a property of the database file, so it's applied through a
+    short-lived connection of its own. The synchronous level only lasts as long as a connection, so it's applied to each
+    of Pony's connections by the pool handing them out, before their next transaction begins. WAL with NORMAL sync
+    means a commit costs an append to the log instead of an fsync of the whole database.
 
-class MapDenormalize(eve_sde.Entity):
-    _table_ = 'mapDenormalize'
-    itemID = PrimaryKey(int)
-    itemName = Required(unicode)
+    The Notification table is indexed by sent_date for pruning, and the file is switched to incremental auto vacuum
+    so the space pruned rows leave behind can be handed back by vacuum_sovbot_db(). Switching rewrites the file once.
+    """
+    global _synchronous
+    con = sqlite3.connect(database_path)
+    try:
+        con.execute('CREATE INDEX IF NOT EXISTS "idx_notification__sent_date" ON "Notification" ("sent_date")')
+        con.commit()
+        if con.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            con.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            con.execute('VACUUM')
+        con.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+    finally:
+        con.close()
+    _synchronous = synchronous
 
 
-class Stations(eve_sde.Entity):
-    _table_ = 'staStations'
-    stationID = PrimaryKey(int)
-    stationName = Required(unicode)
+def vacuum_sovbot_db(pages=1000):
+    """Hands back up to `pages` free pages of the database file to the file system. Returns the number freed."""
+    con = sqlite3.connect(database_path)
+    try:
+        return len(con.execute('PRAGMA incremental_vacuum({})'.format(int(pages))).fetchall())
+    finally:
+        con.close()
 
 
-eve_sde.generate_mapping()
+################################
+# Eve Static Data Export Index #
+################################
+# Built from the full SDE dump by the update-sde script, see sde_index.py for the format. Opened on first use.
+sde_index_path = os.path.join(os.path.dirname(__file__), 'sde-lookup.bin')
+eve_sde = SDEIndex(sde_index_path)
 
 if __name__ == "__main__":
     # quick sanity check demo
-    with db_session:
-        items = select(item for item in InvTypes if item.typeID in [34, 35, 36, 37])
-        for dat in items:
-            print dat.typeName, dat.typeID
-        map_item = MapDenormalize.get(itemID='40009081')
-        print map_item.itemName
\ No newline at end of file
+    for type_id, type_name in sorted(eve_sde.lookup_many('invTypes', [34, 35, 36, 37]).iteritems()):
+        print type_name, type_id
+    print eve_sde.lookup('mapDenormalize', 40009081)
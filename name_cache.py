@@ -0,0 +1,85 @@
+"""Persistent cache of character, corporation and alliance names fetched from the Eve API."""
+from datetime import datetime, timedelta
+from pony.orm import db_session, select
+from models import CharacterName
+
+# Names are read from SQLite in chunks of this many ids, which keeps queries under SQLite's parameter limit.
+QUERY_CHUNK_SIZE = 500
+
+
+class NameCache(object):
+    """
+    Maps name ids to names. Names are kept in the CharacterName table of sovbot.sqlite so they survive restarts, with
+    a dictionary in front of it so ids seen in earlier cycles never touch the database again. Names older than `ttl`
+    are treated as unknown so renamed corporations and alliances eventually get picked up. A `read_only` cache reads
+    the table but keeps the names it's given in memory only, e.g. for replay.py without --record.
+    """
+    def __init__(self, ttl=timedelta(days=7), clock=datetime.utcnow, read_only=False):
+        self.ttl = ttl
+        self.clock = clock
+        self.read_only = read_only
+        self._names = {}  # id -> (name, fetched)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, name_ids):
+        """
+        Returns a tuple of a dictionary mapping string ids to names for every id with a fresh cached name, and the set
+        of int ids which still need to be fetched from the API.
+        """
+        name_ids = set(int(name_id) for name_id in name_ids)
+        self._load(name_id for name_id in name_ids if name_id not in self._names)
+        oldest = self.clock() - self.ttl
+        names = {}
+        missing = set()
+        for name_id in name_ids:
+            name, fetched = self._names.get(name_id, (None, None))
+            if name is not None and fetched >= oldest:
+                names[str(name_id)] = name
+            else:
+                missing.add(name_id)
+        self.hits += len(names)
+        self.misses += len(missing)
+        return names, missing
+
+    def store(self, names):
+        """Records a dictionary of id -> name freshly fetched from the API, in a single transaction."""
+        fetched = self.clock()
+        names = dict((int(name_id), name) for name_id, name in names.iteritems())
+        if not self.read_only:
+            self._store(names, fetched)
+        self._names.update((name_id, (name, fetched)) for name_id, name in names.iteritems())
+
+    @db_session
+    def _store(self, names, fetched):
+        ids = list(names)
+        existing = {}
+        for start in xrange(0, len(ids), QUERY_CHUNK_SIZE):
+            chunk = ids[start:start + QUERY_CHUNK_SIZE]
+            existing.update((row.id, row) for row in select(n for n in CharacterName if n.id in chunk))
+        for name_id, name in names.iteritems():
+            if name_id in existing:
+                existing[name_id].name = name
+                existing[name_id].fetched = fetched
+            else:
+                CharacterName(id=name_id, name=name, fetched=fetched)
+
+    def stats(self):
+        """Returns cache counters as a dictionary, e.g. for logging."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'cached': len(self._names)}
+
+    @db_session
+    def _load(self, name_ids):
+        ids = list(name_ids)
+        for start in xrange(0, len(ids), QUERY_CHUNK_SIZE):
+            chunk = ids[start:start + QUERY_CHUNK_SIZE]
+            for row in select(n for n in CharacterName if n.id in chunk):
+                self._names[row.id] = (row.name, row.fetched)
+
+
+# A cache shared by every notification set that isn't given one of its own.
+shared_name_cache = NameCache()
@@ -0,0 +1,75 @@
+"""Decoding of notification bodies, which the Eve API delivers as small YAML documents."""
+import re
+import yaml
+from twisted.internet.defer import gatherResults, succeed
+from twisted.internet.threads import deferToThread
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# Bodies are decoded on the reactor's thread pool this many at a time, smaller cycles are decoded inline.
+BATCH_SIZE = 200
+
+# Most notification types, including every structure attack alert, have flat bodies made of `key: value` lines with
+# numeric or null values. The patterns below only accept values which YAML would read the same way, e.g. no octal
+# looking integers and no exponents without a sign. Anything else is left to the YAML loader.
+_FLAT_LINE = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*):(?: (.*))?$')
+_INT = re.compile(r'^-?(?:0|[1-9][0-9]*)$')
+_FLOAT = re.compile(r'^-?[0-9]+\.[0-9]+(?:[eE][-+][0-9]+)?$')
+_NULLS = frozenset(['', '~', 'null', 'Null', 'NULL'])
+_RESERVED_KEYS = frozenset(['null', 'true', 'false', 'yes', 'no', 'on', 'off', 'y', 'n'])
+
+
+def parse_body(text):
+    """Decodes one notification body into a dictionary."""
+    if text is None:
+        return {}
+    body = _parse_flat_body(text)
+    if body is None:
+        body = yaml.load(text, Loader=SafeLoader)
+    return body if body is not None else {}
+
+
+def parse_bodies(texts):
+    """Decodes a batch of notification bodies, returning a list of dictionaries in the same order."""
+    return [parse_body(text) for text in texts]
+
+
+def decode_bodies(texts, batch_size=BATCH_SIZE):
+    """
+    Decodes notification bodies without tying up the reactor. Returns a Deferred firing with a list of dictionaries in
+    the same order as `texts`. Large cycles are split into batches which run on the reactor's thread pool.
+    """
+    texts = list(texts)
+    if len(texts) <= batch_size:
+        return succeed(parse_bodies(texts))
+    batches = [deferToThread(parse_bodies, texts[start:start + batch_size])
+               for start in xrange(0, len(texts), batch_size)]
+    d = gatherResults(batches, consumeErrors=True)
+    d.addCallback(lambda results: [body for batch in results for body in batch])
+    return d
+
+
+def _parse_flat_body(text):
+    """Returns the body as a dictionary if it's made of flat numeric `key: value` lines, otherwise None."""
+    body = {}
+    for line in text.split('\n'):
+        if not line:
+            continue
+        match = _FLAT_LINE.match(line)
+        if match is None:
+            return None
+        key, value = match.groups()
+        if key.lower() in _RESERVED_KEYS:
+            return None
+        if value is None or value in _NULLS:
+            body[key] = None
+        elif _INT.match(value):
+            body[key] = int(value)
+        elif _FLOAT.match(value):
+            body[key] = float(value)
+        else:
+            return None
+    return body
@@ -1,309 +1,291 @@
-from pony.orm import db_session
-from models import MapDenormalize, MapSolarSystems, InvTypes
+from alert_groups import AlertGroup
+from notification_record import NotificationRecord
+from sde_resolver import shared_resolver
 
-class NotificationFormatter(object):
-    """Creates human readable messages from notification objects."""
-    def __init__(self, names):
-        self.names = names  # a mapping of strings representing character/corp/alliance ids to names.
-
-    def format(self, notification):
-        """Dispatches the appropriate message method for a given notification's typeID."""
-        return self.type_handlers[notification['typeID']](self, notification)
-
-    @staticmethod
-    @db_session
-    def get_system_name(notification):
-        """Uses the Eve SDE to produce a solar system name from an id."""
-        system_id = notification['body']['solarSystemID']
-        solar_system = MapSolarSystems.get(solarSystemID=system_id)
-        if solar_system:
-            return solar_system.solarSystemName
-        else:
-            return 'unknown solar system'
 
-    @staticmethod
-    @db_session
-    def get_type_name(notification):
-        """Uses the Eve SDE to produce an item name from an id."""
-        if 'typeID' in notification['body']:
-            type_id = notification['body']['typeID']
-        elif 'structureTypeID' in notification['body']:
-            type_id = notification['body']['structureTypeID']
-        else:
-            type_id = None
-        try:
-            type = InvTypes.get(typeID=type_id)
-            return type.typeName
-        except (AttributeError, ValueError):
-            return 'unknown item'
+def _first_want(wants):
+    """Tower resource alerts list the resources a tower wants, we report the first one."""
+    if isinstance(wants, list):
+        wants = wants[0] if wants else None
+    return wants if isinstance(wants, dict) else {}
 
-    @staticmethod
-    @db_session
-    def get_moon_name(notification):
-        """Uses the Eve SDE to produce a planet-moon name from an id."""
-        moon_id = notification['body']['moonID']
-        moon = MapDenormalize.get(itemID=moon_id)
-        if moon:
-            return moon.itemName
-        else:
-            return 'unknown location'
 
-    @staticmethod
-    @db_session
-    def get_planet_name(notification):
-        """Uses the Eve SDE to produce a planet name from an id."""
-        planet_id = notification['body']['planetID']
-        planet = MapDenormalize.get(itemID=planet_id)
-        if planet:
-            return planet.itemName
-        else:
-            return 'unknown location'
+# Resolvers turn the value read from a notification into the text that goes into its message. Each one is a pair of
+# a Python expression producing the text from {value}, which is compiled into the render function of every message
+# spec using it, and a function taking (notification, value) and returning the (table, id) pairs the text depends on,
+# so they can all be loaded before rendering a batch.
+RESOLVERS = {
+    'system': ('resolver.system_name({value})',
+               lambda notification, value: [('systems', value)]),
+    'type': ('resolver.type_name({value})',
+             lambda notification, value: [('types', value)]),
+    'item': ('resolver.item_name({value})',
+             lambda notification, value: [('items', value)]),
+    # The moon a tower is anchored at, or its solar system if it isn't at a moon.
+    'moon_or_system': ('(resolver.item_name({value}) if {value} else resolver.system_name(notification.solar_system_id))',
+                       lambda notification, value: [('items', value), ('systems', notification.solar_system_id)]),
+    'name': ('get_name({value})',
+             lambda notification, value: [('names', value)]),
+    'percent': ('int({value} * 100)',
+                lambda notification, value: []),
+    'raw': ('{value}',
+            lambda notification, value: []),
+    'want_quantity': ('_first_want({value}).get("quantity")',
+                      lambda notification, value: []),
+    'want_type': ('resolver.type_name(_first_want({value}).get("typeID"))',
+                  lambda notification, value: [('types', _first_want(value).get('typeID'))]),
+}
 
-    def get_name(self, name_id):
-        """Gets a name from the ids to names mapping the object was initialized with."""
-        name = self.names.get(str(name_id), "unknown")
-        return name
+# Field sources are NotificationRecord attributes, body keys, or tuples of body keys meaning the first one present.
+STRUCTURE_TYPE = ('typeID', 'structureTypeID')
 
-    # All methods below this point produce a message string from a given notification object
-    # and are dispatched to by the NotificationFormatter.format() method.
-    def n38_sov_claim_fail(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        message = "[{timestamp}] Sovereignty claim failed in {system}.".format(timestamp=timestamp, system=system_name)
-        return message
+# Maps notification typeIDs to the message template for that type and the fields that fill it in. Every template also
+# gets the notification's {timestamp}. Supporting a new type only takes a new entry here.
+MESSAGE_SPECS = {
+    38: ("[{timestamp}] Sovereignty claim failed in {system}.",
+         {'system': ('system', 'solar_system_id')}),
+    40: ("[{timestamp}] Sovereignty bill late for {system}.",
+         {'system': ('system', 'solar_system_id')}),
+    42: ("[{timestamp}] Sovereignty claim lost in {system}.",
+         {'system': ('system', 'solar_system_id')}),
+    44: ("[{timestamp}] Sovereignty claim acquired in {system}.",
+         {'system': ('system', 'solar_system_id')}),
+    45: ("[{timestamp}] Control tower anchored in {system}: {type} [{alliance}] <{corp}> at {moon}.",
+         {'system': ('system', 'solar_system_id'),
+          'moon': ('item', 'moonID'),
+          'type': ('type', STRUCTURE_TYPE),
+          'alliance': ('name', 'allianceID'),
+          'corp': ('name', 'corpID')}),
+    46: ("[{timestamp}] Alliance structure vulnerable: {type} in {system}.",
+         {'system': ('system', 'solar_system_id'),
+          'type': ('type', STRUCTURE_TYPE)}),
+    47: ("[{timestamp}] Alliance structure invulnerable: {type} in {system}.",
+         {'system': ('system', 'solar_system_id'),
+          'type': ('type', STRUCTURE_TYPE)}),
+    48: ("[{timestamp}] SBU anchored in {system}.",
+         {'system': ('system', 'solar_system_id')}),
+    49: ("[{timestamp}] Structure won/lost in {system}: {body}",
+         {'system': ('system', 'solar_system_id'),
+          'body': ('raw', 'body')}),
+    75: ("[{timestamp}] Tower Alert: {type} under attack at {location}. "
+         "Shield: {shield}%, Armor: {armor}%, Hull: {hull}%, Attacker: {character} [{alliance}] <{corp}>",
+         {'location': ('moon_or_system', 'moonID'),
+          'type': ('type', STRUCTURE_TYPE),
+          'character': ('name', 'aggressor_id'),
+          'corp': ('name', 'aggressor_corp_id'),
+          'alliance': ('name', 'aggressor_alliance_id'),
+          'shield': ('percent', 'shield'),
+          'armor': ('percent', 'armor'),
+          'hull': ('percent', 'hull')}),
+    76: ("[{timestamp}] Tower resource alert: {type} in {location} only has {qty} {fuel}s remaining.",
+         {'location': ('item', 'moonID'),
+          'type': ('type', STRUCTURE_TYPE),
+          'qty': ('want_quantity', 'wants'),
+          'fuel': ('want_type', 'wants')}),
+    77: ("[{timestamp}] {type} under attack in {system}. Shield: {shield}%, Attacker: {character}.",
+         {'system': ('system', 'solar_system_id'),
+          'type': ('type', STRUCTURE_TYPE),
+          'character': ('name', 'aggressor_id'),
+          'shield': ('percent', 'shield')}),
+    78: ("[{timestamp}] Station state change message: {body}",
+         {'body': ('raw', 'body')}),
+    79: ("[{timestamp}] Station owned by {old} in {system} was conquered by {character} of {new}.",
+         {'system': ('system', 'solar_system_id'),
+          'character': ('name', 'charID'),
+          'old': ('name', 'oldOwnerID'),
+          'new': ('name', 'newOwnerID')}),
+    80: ("[{timestamp}] Station under attack in {system}. Shield: {shield}%, Armor: {armor}%, Hull: {hull}%, "
+         "Attacker: {character}.",
+         {'system': ('system', 'solar_system_id'),
+          'character': ('name', 'aggressor_id'),
+          'shield': ('percent', 'shield'),
+          'armor': ('percent', 'armor'),
+          'hull': ('percent', 'hull')}),
+    86: ("[{timestamp}] TCU under attack in {system}. Shield: {shield}%, Armor: {armor}%, Hull: {hull}%, "
+         "Attacker: {character} [{alliance}] <{corp}>.",
+         {'system': ('system', 'solar_system_id'),
+          'character': ('name', 'aggressor_id'),
+          'corp': ('name', 'aggressor_corp_id'),
+          'alliance': ('name', 'aggressor_alliance_id'),
+          'shield': ('percent', 'shield'),
+          'armor': ('percent', 'armor'),
+          'hull': ('percent', 'hull')}),
+    87: ("[{timestamp}] SBU under attack in {system}. Shield: {shield}%, Armor: {armor}%, Hull: {hull}%, "
+         "Attacker: {character} [{alliance}] <{corp}>.",
+         {'system': ('system', 'solar_system_id'),
+          'character': ('name', 'aggressor_id'),
+          'corp': ('name', 'aggressor_corp_id'),
+          'alliance': ('name', 'aggressor_alliance_id'),
+          'shield': ('percent', 'shield'),
+          'armor': ('percent', 'armor'),
+          'hull': ('percent', 'hull')}),
+    88: ("[{timestamp}] IHUB under attack in {system}. Shield: {shield}%, Armor: {armor}%, Hull: {hull}%, "
+         "Attacker: {character}.",
+         {'system': ('system', 'solar_system_id'),
+          'character': ('name', 'aggressor_id'),
+          'shield': ('percent', 'shield'),
+          'armor': ('percent', 'armor'),
+          'hull': ('percent', 'hull')}),
+    93: ("[{timestamp}] POCO under attack at {location}. Shield: {shield}%, Armor: {armor}%, Hull: {hull}%, "
+         "Attacker: {character}.",
+         {'location': ('item', 'planetID'),
+          'character': ('name', 'aggressor_id'),
+          'shield': ('percent', 'shield'),
+          'armor': ('percent', 'armor'),
+          'hull': ('percent', 'hull')}),
+    94: ("[{timestamp}] POCO has entered reinforced mode at {location}.",
+         {'location': ('item', 'planetID')}),
+    147: ("[{timestamp}] Entosis capture in progress against {structure} in {system}.",
+          {'system': ('system', 'solar_system_id'),
+           'structure': ('type', STRUCTURE_TYPE)}),
+    148: ("[{timestamp}] {structure} in {system} has been restored.",
+          {'system': ('system', 'solar_system_id'),
+           'structure': ('type', STRUCTURE_TYPE)}),
+    149: ("[{timestamp}] {structure} in {system} has been disabled.",
+          {'system': ('system', 'solar_system_id'),
+           'structure': ('type', STRUCTURE_TYPE)}),
+}
 
-    def n40_sov_bill_late(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        message = "[{timestamp}] Sovereignty bill late for {system}.".format(timestamp=timestamp, system=system_name)
-        return message
+# Maps attack alert typeIDs to a description of what's under attack, used to head the summary of a group of alerts.
+# The fields are filled in from the group's latest alert.
+SUMMARY_SPECS = {
+    75: ("{type} under attack at {location}",
+         {'location': ('moon_or_system', 'moonID'),
+          'type': ('type', STRUCTURE_TYPE)}),
+    77: ("{type} under attack in {system}",
+         {'system': ('system', 'solar_system_id'),
+          'type': ('type', STRUCTURE_TYPE)}),
+    80: ("Station under attack in {system}",
+         {'system': ('system', 'solar_system_id')}),
+    86: ("TCU under attack in {system}",
+         {'system': ('system', 'solar_system_id')}),
+    87: ("SBU under attack in {system}",
+         {'system': ('system', 'solar_system_id')}),
+    88: ("IHUB under attack in {system}",
+         {'system': ('system', 'solar_system_id')}),
+    93: ("POCO under attack at {location}",
+         {'location': ('item', 'planetID')}),
+}
 
-    def n42_sov_claim_lost(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        message = "[{timestamp}] Sovereignty claim lost in {system}.".format(timestamp=timestamp, system=system_name)
-        return message
+SUMMARY_TEMPLATE = "[{first} - {last}] {count} alerts: {target}. {levels}. Attackers: {attackers}."
 
-    def n44_sov_claim_acquired(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        message = "[{timestamp}] Sovereignty claim acquired in {system}.".format(timestamp=timestamp, system=system_name)
-        return message
 
-    def n45_alliance_anchoring_alert(self, notification):
-        timestamp = notification['sentDate']
-        alliance_name = self.get_name(notification['body']['allianceID'])
-        corporation_name = self.get_name(notification['body']['corpID'])
-        type_name = self.get_type_name(notification)
-        system_name = self.get_system_name(notification)
-        moon_name = self.get_moon_name(notification)
-        message = "[{timestamp}] Control tower anchored in {system}: {type} [{alliance}] <{corp}> at {moon}."\
-            .format(timestamp=timestamp, system=system_name, moon=moon_name,
-                    type=type_name, alliance=alliance_name, corp=corporation_name)
-        return message
+def _first_key(body, keys):
+    for key in keys:
+        if key in body:
+            return body[key]
+    return None
 
-    def n46_alliance_structure_vulnerable(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        type_name = self.get_type_name(notification)
-        message = "[{timestamp}] Alliance structure vulnerable: {type} in {system}."\
-            .format(timestamp=timestamp, type=type_name, system=system_name)
-        return message
 
-    def n47_alliance_structure_invulnerable(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        type_name = self.get_type_name(notification)
-        message = "[{timestamp}] Alliance structure invulnerable: {type} in {system}."\
-            .format(timestamp=timestamp, type=type_name, system=system_name)
-        return message
+def _source_expression(source):
+    """Returns a Python expression reading a field's source from `notification` or its `body`."""
+    if isinstance(source, tuple):
+        return '_first_key(body, {!r})'.format(source)
+    if source in NotificationRecord.__slots__:
+        return 'notification.{}'.format(source)
+    return 'body.get({!r})'.format(source)
 
-    def n48_sov_disruptor_anchored(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        message = "[{timestamp}] SBU anchored in {system}.".format(timestamp=timestamp, system=system_name)
-        return message
 
-    def n49_structure_won_lost(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        message = "[{timestamp}] Structure won/lost in {system}: {body}"\
-            .format(timestamp=timestamp, system=system_name, body=notification['body'])
-        return message
+class CompiledSpec(object):
+    """
+    A message spec compiled into a render function, which fills in the template with one straight-line expression per
+    field, and a references function listing the (table, id) pairs that notification's message will look up.
+    """
+    __slots__ = ('render', 'references')
 
-    def n75_tower_alert(self, notification):
-        timestamp = notification['sentDate']
-        if notification['body']['moonID']:
-            location_name = self.get_moon_name(notification)
-        else:
-            location_name = self.get_system_name(notification)
-        type_name = self.get_type_name(notification)
-        character_name = self.get_name(notification['body']['aggressorID'])
-        corp_name = self.get_name(notification['body']['aggresssorCorpID'])
-        alliance_name = self.get_name(notification['body']['aggressorAllianceID'])
-        shield_value = int(float(notification['body']['shieldValue']) * 100)
-        armor_value = int(float(notification['body']['armorValue']) * 100)
-        hull_value = int(float(notification['body']['hullValue']) * 100)
-        message = "[{timestamp}] Tower Alert: {type} under attack at {location}. " \
-                  "Shield: {shield}%, Armor: {armor}%, Hull: {hull}%, Attacker: {character} [{alliance}] <{corp}>"\
-            .format(timestamp=timestamp, type=type_name, location=location_name, shield=shield_value, armor=armor_value,
-                    hull=hull_value, character=character_name, alliance=alliance_name, corp=corp_name)
-        return message
+    def __init__(self, template, fields):
+        fields = sorted(fields.iteritems())
+        namespace = {'fill': template.format, '_first_key': _first_key, '_first_want': _first_want}
+        arguments = ''.join(', {name}={expression}'.format(
+            name=name, expression=RESOLVERS[resolver][0].format(value=_source_expression(source)))
+            for name, (resolver, source) in fields)
+        exec compile('def render(formatter, notification):\n'
+                     '    body = notification.body\n'
+                     '    resolver = formatter.resolver\n'
+                     '    get_name = formatter.get_name\n'
+                     '    return fill(timestamp=notification.timestamp{})\n'.format(arguments),
+                     '<message spec>', 'exec') in namespace
+        self.render = namespace['render']
+        readers = [(eval('lambda notification, body: ' + _source_expression(source), namespace), RESOLVERS[resolver][1])
+                   for name, (resolver, source) in fields]
 
-    def n76_tower_resource_alert(self, notification):
-        timestamp = notification['sentDate']
-        location_name = self.get_moon_name(notification)
-        type_name = self.get_type_name(notification)
-        resource_quantity = notification['body']['wants']['quantity']
-        resource_name = self.get_type_name(notification['body']['wants']['typeID'])
-        message = "[{timestamp}] Tower resource alert: {type} in {location} only has {qty} {fuel}s remaining."\
-            .format(timestamp=timestamp, type=type_name, location=location_name, qty=resource_quantity, fuel=resource_name)
-        return message
+        def references(notification):
+            body = notification.body
+            return [pair for read, refer in readers for pair in refer(notification, read(notification, body))]
+        self.references = references
 
-    def n77_station_service_alert(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        character_name = self.get_name(notification['body']['aggressorID'])
-        shield_value = int(float(notification['body']['shieldValue']) * 100)
-        type_name = self.get_type_name(notification)
-        message = "[{timestamp}] {type} under attack in {system}. Shield: {shield}%, Attacker: {character}."\
-            .format(timestamp=timestamp, type=type_name, system=system_name, character=character_name, shield=shield_value)
-        return message
 
-    def n78_station_state_change(self, notification):
-        timestamp = notification['sentDate']
-        message = "[{timestamp}] Station state change message: {body}".format(timestamp=timestamp, body=notification['body'])
-        return message
+def compile_specs(specs):
+    return dict((type_id, CompiledSpec(template, fields)) for type_id, (template, fields) in specs.iteritems())
 
-    def n79_station_conquered(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        character_name = self.get_name(notification['body']['charID'])
-        old_owner_name = self.get_name(notification['body']['oldOwnerID'])
-        new_owner_name = self.get_name(notification['body']['newOwnerID'])
-        message = "[{timestamp}] Station owned by {old} in {system} was conquered by {character} of {new}."\
-            .format(timestamp=timestamp, old=old_owner_name, system=system_name, character=character_name, new=new_owner_name)
-        return message
 
-    def n80_station_aggression(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        character_name = self.get_name(notification['body']['aggressorID'])
-        shield_value = int(float(notification['body']['shieldValue']) * 100)
-        armor_value = int(float(notification['body']['armorValue']) * 100)
-        hull_value = int(float(notification['body']['hullValue']) * 100)
-        message = "[{timestamp}] Station under attack in {system}. Shield: {shield}%, Armor: " \
-                  "{armor}%, Hull: {hull}%, Attacker: {character}."\
-            .format(timestamp=timestamp, system=system_name, character=character_name,
-                    shield=shield_value, armor=armor_value, hull=hull_value)
-        return message
-
-    def n86_tcu_under_attack(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        character_name = self.get_name(notification['body']['aggressorID'])
-        corp_name = self.get_name(notification['body']['aggressorCorpID'])
-        alliance_name = self.get_name(notification['body']['aggressorAllianceID'])
-        shield_value = int(float(notification['body']['shieldValue']) * 100)
-        armor_value = int(float(notification['body']['armorValue']) * 100)
-        hull_value = int(float(notification['body']['hullValue']) * 100)
-        message = "[{timestamp}] TCU under attack in {system}. Shield: {shield}%, Armor: {armor}%, Hull: {hull}%, " \
-                  "Attacker: {character} [{alliance}] <{corp}>."\
-            .format(timestamp=timestamp, system=system_name, character=character_name, shield=shield_value,
-                    armor=armor_value, hull=hull_value, alliance=alliance_name, corp=corp_name)
-        return message
+class NotificationFormatter(object):
+    """Creates human readable messages from NotificationRecords."""
+    # Maps notification typeIDs to the compiled spec that handles message creation for that type.
+    type_handlers = compile_specs(MESSAGE_SPECS)
+    # Maps attack alert typeIDs to the compiled spec describing the target of a group of them.
+    summary_handlers = compile_specs(SUMMARY_SPECS)
 
-    def n87_sbu_under_attack(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        character_name = self.get_name(notification['body']['aggressorID'])
-        corp_name = self.get_name(notification['body']['aggressorCorpID'])
-        alliance_name = self.get_name(notification['body']['aggressorAllianceID'])
-        shield_value = int(float(notification['body']['shieldValue']) * 100)
-        armor_value = int(float(notification['body']['armorValue']) * 100)
-        hull_value = int(float(notification['body']['hullValue']) * 100)
-        message = "[{timestamp}] SBU under attack in {system}. Shield: {shield}%, Armor: {armor}%, Hull: {hull}%, " \
-                  "Attacker: {character} [{alliance}] <{corp}>."\
-            .format(timestamp=timestamp, system=system_name, character=character_name, shield=shield_value,
-                    armor=armor_value, hull=hull_value, alliance=alliance_name, corp=corp_name)
-        return message
+    def __init__(self, names, resolver=None):
+        self.names = names  # a mapping of strings representing character/corp/alliance ids to names.
+        self.resolver = resolver if resolver is not None else shared_resolver  # caches Eve SDE lookups.
 
-    def n88_ihub_under_attack(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        character_name = self.get_name(notification['body']['aggressorID'])
-        shield_value = int(float(notification['body']['shieldValue']) * 100)
-        armor_value = int(float(notification['body']['armorValue']) * 100)
-        hull_value = int(float(notification['body']['hullValue']) * 100)
-        message = "[{timestamp}] IHUB under attack in {system}. Shield: {shield}%, Armor: {armor}%, Hull: {hull}%, " \
-                  "Attacker: {character}.".format(timestamp=timestamp, system=system_name, character=character_name,
-                                                  shield=shield_value, armor=armor_value, hull=hull_value)
-        return message
+    def format(self, notification):
+        """Dispatches the appropriate message spec for a given notification's typeID, or summarizes an AlertGroup."""
+        if isinstance(notification, AlertGroup):
+            return self.format_group(notification)
+        return self.type_handlers[notification.type_id].render(self, notification)
 
-    def n93_poco_under_attack(self, notification):
-        timestamp = notification['sentDate']
-        planet_name = self.get_planet_name(notification)
-        character_name = self.get_name(notification['body']['aggressorID'])
-        shield_value = int(float(notification['body']['shieldValue']) * 100)
-        armor_value = int(float(notification['body']['armorValue']) * 100)
-        hull_value = int(float(notification['body']['hullValue']) * 100)
-        message = "[{timestamp}] POCO under attack at {location}. Shield: {shield}%, Armor: {armor}%, Hull: {hull}%, " \
-                  "Attacker: {character}.".format(timestamp=timestamp, location=planet_name, character=character_name,
-                                                  shield=shield_value, armor=armor_value, hull=hull_value)
-        return message
+    def format_group(self, group):
+        """Summarizes a group of attack alerts: its time span, how the structure's health changed, and who attacked."""
+        first, last = group.first, group.last
+        levels = ', '.join('{label}: {first}% -> {last}%'.format(
+            label=label, first=int(getattr(first, attribute) * 100), last=int(getattr(last, attribute) * 100))
+            for label, attribute in (('Shield', 'shield'), ('Armor', 'armor'), ('Hull', 'hull'))
+            if getattr(first, attribute) is not None and getattr(last, attribute) is not None)
+        return SUMMARY_TEMPLATE.format(first=first.timestamp, last=last.timestamp, count=len(group),
+                                       target=self.summary_handlers[group.type_id].render(self, last),
+                                       levels=levels or 'No health reported',
+                                       attackers=', '.join(self.get_attacker(*attacker) for attacker in group.attackers()) or 'unknown')
 
-    def n94_poco_entered_reinforced(self, notification):
-        timestamp = notification['sentDate']
-        planet_name = self.get_planet_name(notification)
-        message = "[{timestamp}] POCO has entered reinforced mode at {location}."\
-            .format(timestamp=timestamp, location=planet_name)
-        return message
+    def get_attacker(self, character_id, corp_id, alliance_id):
+        """Names an attacker along with their [alliance] and <corp>, when known."""
+        attacker = self.get_name(character_id)
+        if alliance_id:
+            attacker += ' [{}]'.format(self.get_name(alliance_id))
+        if corp_id:
+            attacker += ' <{}>'.format(self.get_name(corp_id))
+        return attacker
 
-    def n147_entosis_capture_in_progress(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        type_name = self.get_type_name(notification)
-        message = "[{timestamp}] Entosis capture in progress against {structure} in {system}."\
-            .format(timestamp=timestamp, structure=type_name, system=system_name)
-        return message
+    def format_many(self, notifications):
+        """Formats a batch of notifications, loading every SDE name they refer to up front."""
+        notifications = list(notifications)
+        self.prefetch(notifications)
+        return [self.format(notification) for notification in notifications]
 
-    def n148_structure_restored(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        type_name = self.get_type_name(notification)
-        message = "[{timestamp}] {structure} in {system} has been restored."\
-            .format(timestamp=timestamp, structure=type_name, system=system_name)
-        return message
+    def prefetch(self, notifications):
+        """Loads the SDE names referenced by a batch of notifications in one pass per table."""
+        references = self.references(notifications)
+        self.resolver.prefetch(system_ids=references['systems'], type_ids=references['types'],
+                               item_ids=references['items'], station_ids=references['stations'])
 
-    def n149_structure_disabled_by_entosis(self, notification):
-        timestamp = notification['sentDate']
-        system_name = self.get_system_name(notification)
-        type_name = self.get_type_name(notification)
-        message = "[{timestamp}] {structure} in {system} has been disabled."\
-            .format(timestamp=timestamp, structure=type_name, system=system_name)
-        return message
+    @classmethod
+    def references(cls, notifications):
+        """
+        Returns a dictionary of table -> set of ids the messages for a batch of notifications, and of the alerts in any
+        AlertGroups among them, will look up.
+        """
+        references = {'systems': set(), 'types': set(), 'items': set(), 'stations': set(), 'names': set()}
+        for notification in notifications:
+            members = notification.notifications if isinstance(notification, AlertGroup) else [notification]
+            for member in members:
+                if member.has_body and member.type_id in cls.type_handlers:
+                    for table, item_id in cls.type_handlers[member.type_id].references(member):
+                        if item_id is not None:
+                            references[table].add(item_id)
+        return references
 
-    # Maps notification typeIDs to the method that handles message creation for that type.
-    type_handlers = {'38': n38_sov_claim_fail,
-                     '40': n40_sov_bill_late,
-                     '42': n42_sov_claim_lost,
-                     '44': n44_sov_claim_acquired,
-                     '45': n45_alliance_anchoring_alert,
-                     '46': n46_alliance_structure_vulnerable,
-                     '47': n47_alliance_structure_invulnerable,
-                     '48': n48_sov_disruptor_anchored,
-                     '49': n49_structure_won_lost,
-                     '75': n75_tower_alert,
-                     '76': n76_tower_resource_alert,
-                     '77': n77_station_service_alert,
-                     '78': n78_station_state_change,
-                     '79': n79_station_conquered,
-                     '80': n80_station_aggression,
-                     '86': n86_tcu_under_attack,
-                     '87': n87_sbu_under_attack,
-                     '88': n88_ihub_under_attack,
-                     '93': n93_poco_under_attack,
-                     '94': n94_poco_entered_reinforced,
-                     '147': n147_entosis_capture_in_progress,
-                     '148': n148_structure_restored,
-                     '149': n149_structure_disabled_by_entosis}
+    def get_name(self, name_id):
+        """Gets a name from the ids to names mapping the object was initialized with."""
+        name = self.names.get(str(name_id), "unknown")
+        return name
@@ -0,0 +1,75 @@
+"""Compact representation of a single notification as it moves through the pipeline."""
+from datetime import datetime
+
+API_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float_or_none(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class NotificationRecord(object):
+    """
+    A notification header, its decoded body, and the body fields most message types use. IDs are ints and the sent
+    date is a datetime. The common fields are None until a body is attached with set_body(), or if the body doesn't
+    have them.
+    """
+    __slots__ = ('id', 'type_id', 'sender_id', 'sent_date', 'body',
+                 'solar_system_id', 'aggressor_id', 'aggressor_corp_id', 'aggressor_alliance_id',
+                 'shield', 'armor', 'hull')
+
+    def __init__(self, notification_id, type_id, sent_date, sender_id=None):
+        self.id = notification_id
+        self.type_id = type_id
+        self.sender_id = sender_id
+        self.sent_date = sent_date
+        self.body = None
+        self.solar_system_id = None
+        self.aggressor_id = None
+        self.aggressor_corp_id = None
+        self.aggressor_alliance_id = None
+        self.shield = None
+        self.armor = None
+        self.hull = None
+
+    @classmethod
+    def from_attributes(cls, attributes):
+        """Creates a record from the attributes of a notification header <row>."""
+        return cls(int(attributes['notificationID']), int(attributes['typeID']),
+                   datetime.strptime(attributes['sentDate'], API_TIME_FORMAT),
+                   _int_or_none(attributes.get('senderID')))
+
+    def set_body(self, body):
+        """Attaches a decoded body and pulls the common fields out of it."""
+        self.body = body
+        fields = body if isinstance(body, dict) else {}
+        self.solar_system_id = _int_or_none(fields.get('solarSystemID'))
+        self.aggressor_id = _int_or_none(fields.get('aggressorID'))
+        self.aggressor_corp_id = _int_or_none(fields.get('aggressorCorpID'))
+        self.aggressor_alliance_id = _int_or_none(fields.get('aggressorAllianceID'))
+        self.shield = _float_or_none(fields.get('shieldValue'))
+        self.armor = _float_or_none(fields.get('armorValue'))
+        self.hull = _float_or_none(fields.get('hullValue'))
+
+    @property
+    def has_body(self):
+        return self.body is not None
+
+    @property
+    def timestamp(self):
+        """The sent date formatted the way the API formats it."""
+        return self.sent_date.strftime(API_TIME_FORMAT)
+
+    def __repr__(self):
+        return '<NotificationRecord {id} type {type_id} at {timestamp}>'.format(
+            id=self.id, type_id=self.type_id, timestamp=self.timestamp)
@@ -1,15 +1,21 @@
-﻿import requests
-import yaml
-from lxml import etree
+﻿import json
+import random
+from datetime import datetime
 from collections import OrderedDict
-from pony.orm import db_session
 from models import Notification
+from twisted.internet.defer import succeed
 from twisted.python import log
+from alert_groups import group_alerts
+from eve_api import APIError, EveAPI
+from notification_body import decode_bodies
+from name_cache import shared_name_cache
 from notification_formatter import NotificationFormatter
+from notification_record import API_TIME_FORMAT, NotificationRecord
 
 class NotificationSet(object):
     """Object for processsing notifications from the Eve: Online XML API."""
-    def __init__(self, selected_types, key_id, vcode, character_id=None):
+    def __init__(self, selected_types, key_id, vcode, character_id=None, api=None, name_cache=None,
+                 payload_sample_rate=0.0):
         """
         Creates a new NotificationSet and associates it with an API Key. It is only necessary to specify a character_id
         if the given API key has multiple characters. Selected types should be a dictionary with notification typeIDs as
@@ -17,102 +23,274 @@ class NotificationSet(object):
         their headers are recorded if they're not in the set of selected typeIDs.
 
         Visit https://neweden-dev.com/Char/Notifications#Notification_Types for a full list of notification typeIDs.
+
+        All API requests go through `api`, an EveAPI client. Sharing one client between sets lets them reuse its
+        persistent connections; if none is given the set creates its own. Names are looked up in `name_cache`, a
+        NameCache, before asking the API for them. Bodies are only written to the log for a random
+        `payload_sample_rate` fraction of the notifications messages are created for, 0 to never log them.
         """
+        self.api = api if api is not None else EveAPI()
+        self.name_cache = name_cache if name_cache is not None else shared_name_cache
         self.key_id = key_id
         self.vcode = vcode
         self.character_id = character_id
         self.selected_types = selected_types
-        self._headers_tree = None
-        self._texts_tree = None
-        self._notifications = OrderedDict()
+        self._selected_type_ids = frozenset(int(type_id) for type_id in selected_types)
+        self._current_time = None
+        self._cached_until = None
+        self._notifications = OrderedDict()  # notificationID -> NotificationRecord
+        self._texts = OrderedDict()  # notificationID -> undecoded body
         self._names = {}
+        self._duplicates = {}  # notificationID -> notifications from other keys reporting the same event
+        self._suppressed = []  # notifications reporting events which were already sent in an earlier cycle
+        self._groups = {}  # notificationID -> AlertGroup announced in its place
+        self._sent_fingerprints = None
+        self.payload_sample_rate = payload_sample_rate
+        self.response_bytes = {'headers': 0, 'texts': 0, 'names': 0}  # body sizes of the API responses, by request
 
     def get_headers_xml(self):
-        """Grabs notification headers from the API and stores them in the object."""
-        uri = 'https://api.eveonline.com/char/Notifications.xml.aspx'
-        params = self._params()
-        response = requests.get(uri, params=params)
-        log.msg("Incoming Notification Headers XML:\n{content}".format(content=response.content))
-        self._headers_tree = etree.fromstring(response.content)
+        """
+        Grabs notification headers from the API and stores those of the selected types in the object as they stream
+        in. Returns a Deferred.
+        """
+        d = self.api.stream('char/Notifications.xml.aspx', self._params(), self._got_header_row)
+        d.addCallback(self._got_headers_xml)
+        return d
+
+    def _got_header_row(self, row):
+        if int(row.get('typeID')) in self._selected_type_ids:
+            notification = NotificationRecord.from_attributes(row.attrib)
+            self._notifications[notification.id] = notification
+
+    def _got_headers_xml(self, stream):
+        if stream.error:
+            raise APIError("Notification headers request failed with {}".format(stream.error))
+        log.msg("Incoming Notification Headers XML: {bytes} bytes, {rows} rows, {selected} of selected types.".format(
+            bytes=stream.bytes, rows=stream.rows, selected=len(self._notifications)))
+        self.response_bytes['headers'] += stream.bytes
+        self._current_time = stream.current_time
+        self._cached_until = stream.cached_until
+
+    def cache_expires_in(self):
+        """
+        Returns the number of seconds the API will keep serving the headers we fetched from its cache, according to the
+        currentTime and cachedUntil fields of the response, or None if the headers haven't been fetched.
+        """
+        if not self._current_time or not self._cached_until:
+            return None
+        expires_in = self._parse_api_time(self._cached_until) - self._parse_api_time(self._current_time)
+        return expires_in.days * 86400 + expires_in.seconds
 
     def get_texts_xml(self):
-        """Grabs notification contents from the API and stores them in the object."""
-        notification_ids = [row.attrib['notificationID'] for row in self._headers_tree.xpath('result/rowset/row') if row.attrib['typeID'] in self.selected_types.keys()]
-        notification_ids = [id for id in notification_ids if self._notification_is_new(id)]
+        """Grabs the contents of new notifications from the API and stores them in the object. Returns a Deferred."""
+        new_ids = Notification.new_ids(self._notifications.iterkeys())
+        notification_ids = [id for id in self._notifications.iterkeys() if id in new_ids]
         log.msg("Got {} new notification_ids".format(len(notification_ids)))
-        uri = 'https://api.eveonline.com/char/NotificationTexts.xml.aspx'
-        if len(notification_ids) > 0: 
-            params = self._params()
-            params['IDs'] = ','.join(notification_ids)
-            response = requests.get(uri, params=params)
-            if "<result>" in response.content:
-                log.msg("Incoming Notification Texts XML:\n{content}".format(content=response.content))
-                self._texts_tree = etree.fromstring(response.content)
-            else:
-                log.msg("Incoming Notification Texts XML was missing <result></result> block.")
+        if len(notification_ids) > 0:
+            d = self.api.stream_chunked('char/NotificationTexts.xml.aspx', self._params(), notification_ids,
+                                        self._got_text_row)
+            d.addCallback(self._got_texts_xml)
+            return d
         else:
             log.msg("Skipped requesting notification texts because there were no new IDs to fetch.")
+            return succeed(None)
+
+    def _got_text_row(self, row):
+        notification_id = int(row.get('notificationID'))
+        if notification_id in self._notifications:
+            self._texts[notification_id] = row.text
+
+    def _got_texts_xml(self, streams):
+        for stream in streams:
+            if stream.error:
+                log.msg("Incoming Notification Texts XML was missing <result></result> block ({}).".format(stream.error))
+        self.response_bytes['texts'] += sum(stream.bytes for stream in streams)
+        log.msg("Incoming Notification Texts XML: {bytes} bytes, {rows} rows.".format(
+            bytes=sum(stream.bytes for stream in streams), rows=sum(stream.rows for stream in streams)))
 
     def build_notifications(self):
-        """Combines data from headers and into a single notificationID indexed hash that can be iterated over."""
-        for row in self._headers_tree.xpath('result/rowset/row'):
-            attributes = dict(row.attrib)
-            if attributes['typeID'] in self.selected_types:
-                self._notifications[attributes['notificationID']] = attributes
+        """
+        Attaches the decoded bodies of the fetched texts to their notifications. Returns a Deferred, since large
+        batches of bodies are decoded off the reactor thread.
+        """
+        if not self._texts:
+            return succeed(None)
+        notification_ids = list(self._texts.iterkeys())
+        d = decode_bodies(self._texts.itervalues())
+        d.addCallback(self._got_bodies, notification_ids)
+        return d
 
-        for row in self._texts_tree.xpath('result/rowset/row'):
-            attributes = dict(row.attrib)
-            self._notifications[attributes['notificationID']]['body'] = yaml.load(row.text)
+    def _got_bodies(self, bodies, notification_ids):
+        for notification_id, body in zip(notification_ids, bodies):
+            self._notifications[notification_id].set_body(body)
+        self._texts.clear()
 
-    def fetch_character_names(self):
-        """Fetches names by id from the Eve API and stores them in a dictionary for later use in messages."""
-        name_id_types = ['aggressorAllianceID', 'aggressorCorpID', 'aggressorID', 'corpID', 'allianceID', 'charID', 'oldOwnerID', 'newOwnerID']
-        name_ids = set()
-        for key in self._notifications.keys():
-            if 'body' in self._notifications[key]:
-                for id_key in name_id_types:
-                    if id_key in self._notifications[key]['body']:
-                        name_ids.add(self._notifications[key]['body'][id_key])
+    def built_state(self):
+        """
+        Returns what the headers, texts and build stages produced as plain data which can be pickled, e.g. to hand a
+        set built in a worker process to the bot. load_built_state() fills a set in from it.
+        """
+        return {'current_time': self._current_time,
+                'cached_until': self._cached_until,
+                'response_bytes': dict(self.response_bytes),
+                'notifications': [(n.id, n.type_id, n.sent_date, n.sender_id, n.body)
+                                  for n in self._notifications.itervalues()]}
+
+    def load_built_state(self, state):
+        """Fills the set in with the state returned by built_state(), as if it had been built here. Returns self."""
+        self._current_time = state['current_time']
+        self._cached_until = state['cached_until']
+        self.response_bytes.update(state['response_bytes'])
+        for notification_id, type_id, sent_date, sender_id, body in state['notifications']:
+            notification = NotificationRecord(notification_id, type_id, sent_date, sender_id)
+            if body is not None:
+                notification.set_body(body)
+            self._notifications[notification_id] = notification
+        return self
+
+    @classmethod
+    def merge(cls, notification_sets, sent_fingerprints=None):
+        """
+        Combines the built notifications of several sets, e.g. one per API key, into a new set ordered newest first the
+        same way the API orders them. The merged set shares the first set's API client, name cache and logging.
+
+        An event is delivered to every character it concerns under a different notificationID per character, so
+        notifications with the same type, date and body are only kept once. The copies are recorded along with the one
+        that's kept when it's marked as sent. `sent_fingerprints` is a mutable mapping used to remember the events
+        which were sent, so copies which turn up in a later cycle are recorded without being announced again.
+        """
+        notification_sets = list(notification_sets)
+        first = notification_sets[0]
+        merged = cls(first.selected_types, None, None, api=first.api, name_cache=first.name_cache,
+                     payload_sample_rate=first.payload_sample_rate)
+        merged._sent_fingerprints = sent_fingerprints if sent_fingerprints is not None else {}
+        notifications = {}
+        for notification_set in notification_sets:
+            for notification in notification_set._notifications.itervalues():
+                notifications.setdefault(notification.id, notification)
+        ordered = sorted(notifications.itervalues(), key=lambda n: (n.sent_date, n.id), reverse=True)
+        new_ids = Notification.new_ids(notifications.iterkeys())
+        kept = {}
+        for notification in ordered:
+            if notification.id not in new_ids:
+                merged._notifications[notification.id] = notification
+                continue
+            fingerprint = cls._fingerprint(notification)
+            if fingerprint in merged._sent_fingerprints:
+                merged._suppressed.append(notification)
+            elif fingerprint in kept:
+                merged._duplicates.setdefault(kept[fingerprint], []).append(notification)
+            else:
+                kept[fingerprint] = notification.id
+                merged._notifications[notification.id] = notification
+        log.msg("Merged {total} notifications from {sets} sets, dropped {duplicates} duplicates.".format(
+            total=len(notifications), sets=len(notification_sets),
+            duplicates=len(merged._suppressed) + sum(len(copies) for copies in merged._duplicates.itervalues())))
+        return merged
 
+    def aggregate_alerts(self, window):
+        """
+        Collapses runs of new attack alerts about the same structure sent within `window`, a timedelta, into one
+        summary each. The latest alert of a group is announced with the group's summary in place of its own message,
+        the others are recorded along with it when it's marked as sent.
+        """
+        new_ids = Notification.new_ids(self._notifications.iterkeys())
+        groups = group_alerts((n for n in self._notifications.itervalues() if n.id in new_ids), window)
+        for group in groups:
+            self._groups[group.last.id] = group
+            for notification in group.notifications[:-1]:
+                del self._notifications[notification.id]
+                self._duplicates.setdefault(group.last.id, []).extend(
+                    [notification] + self._duplicates.pop(notification.id, []))
+        log.msg("Collapsed {alerts} attack alerts into {groups} summaries.".format(
+            alerts=sum(len(group) for group in groups), groups=len(groups)))
+
+    def _items(self):
+        """Yields the set's notifications, with AlertGroups standing in for the notifications they're announced by."""
+        for notification in self._notifications.itervalues():
+            yield self._groups.get(notification.id, notification)
+
+    def fetch_character_names(self):
+        """Fetches names by id from the Eve API and stores them in a dictionary for later use in messages. Returns a Deferred."""
+        name_ids = NotificationFormatter.references(self._items())['names']
         # The `if name_id` clause in the list comprehension below ensures None values can't sneak in and
         # cause the Eve API to return an error that would prevent us from populating the id->name mapping.
-        name_ids = ','.join([str(name_id) for name_id in name_ids if name_id])
-        log.msg("Collected name IDs ({ids})".format(ids=name_ids))
-        if name_ids:
-            uri = 'https://api.eveonline.com/eve/CharacterName.xml.aspx'
-            params = {'IDs': name_ids}
-            response = requests.get(uri, params=params)
-            log.msg("Incoming Names XML:\n{content}".format(content=response.content))
-            names_tree = etree.fromstring(response.content)
-            self._names = {row.attrib['characterID']: row.attrib['name'] for row in names_tree.xpath('result/rowset/row')}
+        self._names, missing_ids = self.name_cache.lookup([name_id for name_id in name_ids if name_id])
+        log.msg("Found {cached} cached names, collected name IDs to fetch ({ids})".format(
+            cached=len(self._names), ids=','.join(str(name_id) for name_id in missing_ids)))
+        if missing_ids:
+            names = {}
+
+            def got_name_row(row):
+                names[row.get('characterID')] = row.get('name')
+
+            d = self.api.stream_chunked('eve/CharacterName.xml.aspx', {}, missing_ids, got_name_row)
+            d.addCallback(self._got_names_xml, names)
+            return d
         else:
-            log.msg("Skipped requesting names because no valid IDs were collected.")
-            self._names = {}
+            log.msg("Skipped requesting names because no uncached IDs were collected.")
+            return succeed(None)
+
+    def _got_names_xml(self, streams, names):
+        log.msg("Incoming Names XML: {bytes} bytes, {rows} names.".format(
+            bytes=sum(stream.bytes for stream in streams), rows=len(names)))
+        self.response_bytes['names'] += sum(stream.bytes for stream in streams)
+        self.name_cache.store(names)
+        self._names.update(names)
 
     def get_messages(self):
-        """Yields notification message object for each notification which is new."""
+        """
+        Returns a list of (notification, message) pairs for each notification which is new. Nothing is recorded here;
+        pass the notifications whose messages were actually delivered to mark_sent() afterwards.
+        """
         notification_decorator = NotificationFormatter(self._names)
-        messages = []
+        new_ids = Notification.new_ids(self._notifications.iterkeys())
+        new_notifications = []
         for notification in self._notifications.itervalues():
-            if self._notification_is_new(notification['notificationID']):
-                log.msg("Creating message for type {type} with body {body}.".format(type=notification['typeID'], body=notification['body']))
-                messages.append(notification_decorator.format(notification))
-                with db_session:
-                    log.msg("Saving notification so it won't be repeated.")
-                    n = Notification(id=notification['notificationID'], type_id=notification['typeID'], sent_date=notification['sentDate'])
-            else:
-                log.msg("Skipping repeat message for {}.".format(notification['notificationID']))
+            if notification.id in new_ids:
+                if self.payload_sample_rate and random.random() < self.payload_sample_rate:
+                    log.msg("Creating message for type {type} with body {body}.".format(type=notification.type_id, body=notification.body))
+                new_notifications.append(notification)
+        items = [self._groups.get(notification.id, notification) for notification in new_notifications]
+        messages = zip(new_notifications, notification_decorator.format_many(items))
+        log.msg("Created {created} messages, skipped {skipped} notifications which were already sent.".format(
+            created=len(messages), skipped=len(self._notifications) - len(new_notifications)))
         return messages
 
+    def mark_sent(self, notifications):
+        """
+        Records delivered notifications, any copies of them merged in from other keys, and the alerts summarized along
+        with them, in one transaction so they won't be repeated.
+        """
+        notifications = list(notifications)
+        records = list(notifications)
+        for notification in notifications:
+            records.extend(self._duplicates.get(notification.id, []))
+        if self._sent_fingerprints is not None:
+            # Every recorded event counts as announced, including alerts which went out as part of a summary.
+            for record in records:
+                self._sent_fingerprints[self._fingerprint(record)] = record.id
+        records.extend(self._suppressed)
+        self._suppressed = []
+        if records:
+            log.msg("Saving {} notifications so they won't be repeated.".format(len(records)))
+            Notification.record_sent(records)
+
+    @staticmethod
+    def _fingerprint(notification):
+        """Identifies the event a notification reports, independently of which character received it."""
+        if not notification.has_body:
+            return notification.id
+        body = json.dumps(notification.body, sort_keys=True, default=str)
+        return '{type_id}|{timestamp}|{body}'.format(type_id=notification.type_id, timestamp=notification.timestamp, body=body)
+
+    @staticmethod
+    def _parse_api_time(text):
+        return datetime.strptime(text.strip(), API_TIME_FORMAT)
+
     def _params(self):
         """Helper method used to provide required parameters for API request URIs."""
         params = {'keyID': self.key_id, 'vcode': self.vcode}
         if self.character_id:
             params['characterID'] = self.character_id
         return params
-
-    @staticmethod
-    @db_session
-    def _notification_is_new(notification_id):
-        """Returns true if a notificationID hasn't been seen before."""
-        return bool(Notification.get(id=notification_id) is None)
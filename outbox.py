@@ -0,0 +1,119 @@
+"""Paced delivery of outgoing groupchat messages."""
+from collections import deque
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
+
+
+class Outbox(object):
+    """
+    Queues messages and hands them to `send`, with the destination they were queued for and the message, no faster
+    than the XMPP server will accept them, so a burst of alerts neither gets the bot throttled or kicked nor floods the
+    room. The limit covers every destination, since it's the connection the server throttles.
+
+    Sending is limited by a token bucket holding up to `burst` stanzas which refills at `rate` stanzas per second:
+    short bursts go out at once, long ones are paced. With a `batch_size` above 1, messages waiting in the queue are
+    packed into multi-line stanzas of up to `batch_size` messages and `max_stanza_length` characters, so a large burst
+    drains in fewer stanzas. Only consecutive messages for the same destination are packed together, and a lone
+    message is always sent on its own.
+    """
+    def __init__(self, send, rate=2.0, burst=5, batch_size=1, max_stanza_length=4000, clock=reactor):
+        self.send = send
+        self.rate = float(rate)
+        self.burst = burst
+        self.batch_size = max(1, batch_size)
+        self.max_stanza_length = max_stanza_length
+        self.clock = clock
+        self.sent_messages = 0
+        self.sent_stanzas = 0
+        self.failed_messages = 0
+        self.max_depth = 0
+        self.max_latency = 0.0
+        self._total_latency = 0.0
+        self._queue = deque()  # (message, destination, Deferred, time queued)
+        self._tokens = float(burst)
+        self._refilled = clock.seconds()
+        self._drain_call = None
+        self._draining = False
+
+    def put(self, message, destination=None):
+        """
+        Queues a message for a destination, e.g. a room JID. Returns a Deferred firing with the message once it has been
+        handed to the connection, or failing if sending it raised.
+        """
+        d = Deferred()
+        self._queue.append((message, destination, d, self.clock.seconds()))
+        self.max_depth = max(self.max_depth, len(self._queue))
+        if self._drain_call is None and not self._draining:
+            self._drain()
+        return d
+
+    def clear(self, reason):
+        """Drops every queued message, failing their Deferreds with `reason`, e.g. when the connection was lost."""
+        if self._drain_call is not None and self._drain_call.active():
+            self._drain_call.cancel()
+        self._drain_call = None
+        queue, self._queue = self._queue, deque()
+        for message, destination, d, queued in queue:
+            d.errback(reason)
+
+    def depth(self):
+        """The number of messages waiting to be sent."""
+        return len(self._queue)
+
+    def stats(self):
+        """Returns queue counters as a dictionary, e.g. for logging. Latencies are seconds from put() to sending."""
+        return {'depth': len(self._queue),
+                'max_depth': self.max_depth,
+                'messages': self.sent_messages,
+                'stanzas': self.sent_stanzas,
+                'failed': self.failed_messages,
+                'mean_latency': self._total_latency / self.sent_messages if self.sent_messages else 0.0,
+                'max_latency': self.max_latency}
+
+    def _drain(self):
+        self._drain_call = None
+        self._draining = True
+        try:
+            while self._queue:
+                self._refill()
+                if self._tokens < 1:
+                    self._drain_call = self.clock.callLater((1 - self._tokens) / self.rate, self._drain)
+                    return
+                self._tokens -= 1
+                self._send_stanza(self._next_batch())
+        finally:
+            self._draining = False
+
+    def _refill(self):
+        now = self.clock.seconds()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _next_batch(self):
+        batch = [self._queue.popleft()]
+        length = len(batch[0][0])
+        while self._queue and len(batch) < self.batch_size and self._queue[0][1] == batch[0][1]:
+            length += 1 + len(self._queue[0][0])
+            if length > self.max_stanza_length:
+                break
+            batch.append(self._queue.popleft())
+        return batch
+
+    def _send_stanza(self, batch):
+        try:
+            self.send(batch[0][1], '\n'.join(message for message, destination, d, queued in batch))
+        except Exception:
+            failure = Failure()
+            self.failed_messages += len(batch)
+            for message, destination, d, queued in batch:
+                d.errback(failure)
+            return
+        now = self.clock.seconds()
+        self.sent_stanzas += 1
+        for message, destination, d, queued in batch:
+            latency = now - queued
+            self.sent_messages += 1
+            self._total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            d.callback(message)
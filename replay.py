@@ -0,0 +1,225 @@
+"""
+Replays recorded Eve API responses through the notification pipeline, e.g. to backfill a new room, rebuild
+sovbot.sqlite or load test the formatter and the dedup store without waiting on the API:
+
+    python replay.py captures/ --output messages.txt
+    python replay.py captures/ --room room@conference.example.com --rate 2 --record
+
+The capture directory holds Notifications.xml.aspx responses in files named *headers*.xml, NotificationTexts.xml.aspx
+responses in *texts*.xml and CharacterName.xml.aspx responses in *names*.xml, like the samples in docs/. Each headers
+capture is handled like one API key's cycle and the cycles are merged, so events reported by more than one capture are
+announced once. Notifications already recorded in sovbot.sqlite are skipped; pass --record to record the replayed ones
+and the names fetched for them.
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+from datetime import timedelta
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList, fail, gatherResults, succeed
+from twisted.python import log
+from eve_api import RowStream
+from models import open_sovbot_db
+from name_cache import NameCache
+from notification_formatter import MESSAGE_SPECS
+from notification_set import NotificationSet
+from outbox import Outbox
+
+READ_SIZE = 64 * 1024
+
+
+class CapturedRow(object):
+    """The parts of a <row> element notification sets read, kept after RowStream has thrown the element away."""
+    __slots__ = ('attrib', 'text')
+
+    def __init__(self, element):
+        self.attrib = dict(element.attrib)
+        self.text = element.text
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+
+class CaptureAPI(object):
+    """
+    An EveAPI lookalike which streams recorded responses from files instead of requesting them. Each file is only
+    parsed once: its rows are kept in `parsed`, which can be shared between CaptureAPIs reading the same files.
+    """
+    def __init__(self, captures, parsed=None):
+        self.captures = captures  # API page path -> list of capture file paths
+        self.parsed = parsed if parsed is not None else {}  # capture file path -> (closed RowStream, CapturedRows)
+
+    def stream(self, path, params, on_row):
+        return succeed(self._stream_files(path, on_row)[-1])
+
+    def stream_chunked(self, path, params, ids, on_row):
+        # Captures aren't split by the IDs requested; rows for notifications we don't know about are ignored.
+        return succeed(self._stream_files(path, on_row))
+
+    def close(self):
+        return succeed(None)
+
+    def _stream_files(self, path, on_row):
+        streams = []
+        for capture_path in self.captures.get(path) or []:
+            if capture_path not in self.parsed:
+                rows = []
+                stream = RowStream(lambda row: rows.append(CapturedRow(row)))
+                with io.open(capture_path, 'rb') as capture:
+                    for data in iter(lambda: capture.read(READ_SIZE), b''):
+                        stream.feed(data)
+                self.parsed[capture_path] = (stream.close(), rows)
+            stream, rows = self.parsed[capture_path]
+            for row in rows:
+                on_row(row)
+            streams.append(stream)
+        return streams or [RowStream(on_row).close()]
+
+
+class Replay(object):
+    """
+    Runs a directory of captures through the build, dedup and format stages of the notifications task. The texts and
+    names captures are parsed once and shared by every headers capture. Names are only written to sovbot.sqlite's name
+    cache if `record_names` is set.
+    """
+    def __init__(self, capture_dir, selected_types, alert_group_window=None, record_names=False):
+        self.headers = sorted(glob.glob(os.path.join(capture_dir, '*headers*.xml')))
+        self.texts = sorted(glob.glob(os.path.join(capture_dir, '*texts*.xml')))
+        self.names = sorted(glob.glob(os.path.join(capture_dir, '*names*.xml')))
+        self.selected_types = selected_types
+        self.alert_group_window = alert_group_window
+        self.name_cache = NameCache(read_only=not record_names)
+        self.parsed = {}  # shared by the CaptureAPIs of every headers capture
+        self.merged = None
+
+    def run(self):
+        """Returns a Deferred firing with the list of (notification, message) pairs to send, oldest first."""
+        if not self.headers:
+            return fail(ValueError("No *headers*.xml captures to replay."))
+        log.msg("Replaying {headers} headers, {texts} texts and {names} names captures...".format(
+            headers=len(self.headers), texts=len(self.texts), names=len(self.names)))
+        d = gatherResults([self._build(headers) for headers in self.headers], consumeErrors=True)
+        d.addCallback(self._merge)
+        d.addCallback(lambda _: self.merged.fetch_character_names())
+        d.addCallback(lambda _: list(reversed(self.merged.get_messages())))
+        return d
+
+    def _build(self, headers):
+        api = CaptureAPI({'char/Notifications.xml.aspx': [headers],
+                          'char/NotificationTexts.xml.aspx': self.texts,
+                          'eve/CharacterName.xml.aspx': self.names}, self.parsed)
+        notification_set = NotificationSet(self.selected_types, None, None, api=api, name_cache=self.name_cache)
+        d = notification_set.get_headers_xml()
+        d.addCallback(lambda _: notification_set.get_texts_xml())
+        d.addCallback(lambda _: notification_set.build_notifications())
+        d.addCallback(lambda _: notification_set)
+        return d
+
+    def _merge(self, notification_sets):
+        self.merged = NotificationSet.merge(notification_sets)
+        if self.alert_group_window:
+            self.merged.aggregate_alerts(self.alert_group_window)
+
+
+def write_messages(messages, output):
+    """Writes the messages to a file, one per line, and returns the notifications they were for."""
+    with io.open(output, 'ab') as f:
+        for notification, message in messages:
+            f.write((message.encode('utf-8') if isinstance(message, unicode) else message) + b'\n')
+    return [notification for notification, message in messages]
+
+
+def send_messages(messages, room, rate, burst, batch_size):
+    """
+    Connects with the bot's account from settings.py, joins `room` and sends the messages through an Outbox. Returns a
+    Deferred firing with the notifications whose messages were sent.
+    """
+    import settings
+    from twisted.words.protocols.jabber.jid import JID
+    from wokkel.client import XMPPClient
+    from wokkel.muc import MUCClient
+
+    done = Deferred()
+    room_jid = JID(room)
+
+    class ReplayClient(MUCClient):
+        def connectionInitialized(self):
+            MUCClient.connectionInitialized(self)
+            d = self.join(room_jid, settings.nickname)
+            d.addCallback(lambda _: self._send())
+            d.chainDeferred(done)
+
+        def _send(self):
+            outbox = Outbox(self.groupChat, rate=rate, burst=burst, batch_size=batch_size)
+            sent = []
+            queued = [outbox.put(message, room_jid).addCallback(lambda _, notification: sent.append(notification), notification)
+                      for notification, message in messages]
+            d = DeferredList(queued, consumeErrors=True)
+            d.addCallback(lambda _: log.msg("Outbox stats: {}".format(outbox.stats())))
+            d.addCallback(lambda _: sent)
+            return d
+
+    client = XMPPClient(JID(settings.jid), settings.password)
+    ReplayClient().setHandlerParent(client)
+    client.startService()
+
+    def disconnect(result):
+        d = client.stopService()
+        d.addCallback(lambda _: result)
+        return d
+
+    done.addBoth(disconnect)
+    return done
+
+
+def main(args):
+    start = time.time()
+    open_sovbot_db()
+    selected_types = dict((type_id, '') for type_id in (args.types.split(',') if args.types else map(str, MESSAGE_SPECS)))
+    window = timedelta(seconds=args.alert_group_window) if args.alert_group_window else None
+    replay = Replay(args.capture_dir, selected_types, window, record_names=args.record)
+    d = replay.run()
+
+    def deliver(messages):
+        log.msg("Built {count} messages in {seconds:.3f}s.".format(count=len(messages), seconds=time.time() - start))
+        if args.room:
+            return send_messages(messages, args.room, args.rate, args.burst, args.batch_size)
+        return write_messages(messages, args.output)
+
+    def record(delivered):
+        if args.record:
+            replay.merged.mark_sent(delivered)
+        log.msg("Replayed {count} messages in {seconds:.3f}s.".format(count=len(delivered),
+                                                                       seconds=time.time() - start))
+
+    d.addCallback(deliver)
+    d.addCallback(record)
+    return d
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded Eve API responses through the notification pipeline.")
+    parser.add_argument('capture_dir', help="directory holding *headers*.xml, *texts*.xml and *names*.xml captures")
+    parser.add_argument('--output', default='replay.txt', help="file the messages are appended to")
+    parser.add_argument('--room', help="send the messages to this room instead of writing them to a file")
+    parser.add_argument('--rate', type=float, default=2.0, help="messages per second sent to the room")
+    parser.add_argument('--burst', type=int, default=5, help="messages sent to the room at once before --rate applies")
+    parser.add_argument('--batch-size', type=int, default=1, help="pack up to this many messages into one stanza")
+    parser.add_argument('--types', help="comma separated notification typeIDs to replay, all supported ones if omitted")
+    parser.add_argument('--alert-group-window', type=float, default=900.0,
+                        help="seconds of attack alerts about one structure to summarize together, 0 to disable")
+    parser.add_argument('--record', action='store_true',
+                        help="record the replayed notifications as sent and the names fetched for them")
+    args = parser.parse_args()
+    log.startLogging(sys.stdout)
+
+    def run():
+        d = main(args)
+        d.addErrback(log.err)
+        d.addBoth(lambda _: reactor.stop())
+
+    reactor.callWhenRunning(run)
+    reactor.run()
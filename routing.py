@@ -0,0 +1,135 @@
+"""Decides which rooms each notification is announced in."""
+from models import eve_sde
+
+
+class SystemLocations(object):
+    """
+    The constellation and region of every solar system, and the solar system of every celestial and station, read from
+    the SDE index once so routing a notification never has to search it. Also resolves constellation and region names.
+    Nothing is read until a filter needs it, so rooms without location filters never touch the index.
+    """
+    def __init__(self, index=eve_sde):
+        self.index = index
+        self._systems = None  # solar system id -> (constellation id, region id)
+        self._names = {}  # (table, lower case name) -> id, for the tables filters can name
+
+    @property
+    def systems(self):
+        if self._systems is None:
+            self._systems = dict(self.index.items_values('mapSolarSystems'))
+        return self._systems
+
+    def system_of(self, notification):
+        """Returns the solar system a notification is about, from its body or the celestial it names, or None."""
+        if notification.solar_system_id is not None:
+            return notification.solar_system_id
+        body = notification.body if isinstance(notification.body, dict) else {}
+        for key in ('moonID', 'planetID', 'stationID'):
+            item_id = body.get(key)
+            if item_id:
+                values = self.index.values('mapDenormalize', int(item_id))
+                if values and values[0]:
+                    return values[0]
+        return None
+
+    def resolve(self, table, value):
+        """Returns the id of a region, constellation or solar system given either its id or its name."""
+        try:
+            return int(value)
+        except ValueError:
+            pass
+        if table not in self._names:
+            self._names[table] = dict((name.lower(), item_id) for item_id, name in self.index.items(table))
+        item_id = self._names[table].get(value.lower())
+        if item_id is None:
+            raise ValueError("There's no {table} named {value!r} in the SDE.".format(table=table, value=value))
+        return item_id
+
+    def systems_in(self, regions=(), constellations=(), systems=()):
+        """Returns the frozenset of solar system ids in any of the given regions, constellations or systems."""
+        regions = set(self.resolve('mapRegions', region) for region in regions)
+        constellations = set(self.resolve('mapConstellations', constellation) for constellation in constellations)
+        matched = set(self.resolve('mapSolarSystems', system) for system in systems)
+        matched.update(system_id for system_id, (constellation_id, region_id) in self.systems.iteritems()
+                       if region_id in regions or constellation_id in constellations)
+        return frozenset(matched)
+
+
+class Subscription(object):
+    """
+    A room and the notifications it wants. Every filter which is given has to match: the notification's typeID has to
+    be in `types`, it has to be about a solar system in one of `regions`, `constellations` or `systems`, and one of the
+    alliances it involves has to be in `alliances`. Regions, constellations and systems can be given by id or name, and
+    are resolved to solar systems the first time they're needed, so creating a subscription never reads the SDE index.
+    """
+    # Body keys holding the alliances a notification involves, next to its aggressor's alliance.
+    alliance_keys = ('allianceID', 'oldOwnerID', 'newOwnerID')
+
+    def __init__(self, room, locations, types=None, regions=None, constellations=None, systems=None, alliances=None):
+        self.room = room
+        self.locations = locations
+        self.types = frozenset(int(type_id) for type_id in types) if types else None
+        self.places = (regions or (), constellations or (), systems or ())
+        self._systems = None
+        self.alliances = frozenset(int(alliance_id) for alliance_id in alliances) if alliances else None
+
+    @property
+    def systems(self):
+        """The frozenset of solar system ids the notifications have to be about, or None if any will do."""
+        if self._systems is None and any(self.places):
+            self._systems = self.locations.systems_in(*self.places)
+        return self._systems
+
+    def matches(self, notification):
+        if self.types is not None and notification.type_id not in self.types:
+            return False
+        if self.systems is not None and self.locations.system_of(notification) not in self.systems:
+            return False
+        if self.alliances is not None and not self.alliances.intersection(self.involved_alliances(notification)):
+            return False
+        return True
+
+    def involved_alliances(self, notification):
+        body = notification.body if isinstance(notification.body, dict) else {}
+        alliances = set(body.get(key) for key in self.alliance_keys)
+        alliances.add(notification.aggressor_alliance_id)
+        return alliances
+
+
+class Router(object):
+    """Routes notifications to the rooms of the subscriptions they match."""
+    def __init__(self, subscriptions):
+        self.subscriptions = list(subscriptions)
+
+    @classmethod
+    def from_settings(cls, rooms, locations=None):
+        """
+        Creates a router from a list of dictionaries, each with a 'room' JID and optionally 'types', 'regions',
+        'constellations', 'systems' and 'alliances' lists, as in example_settings.py.
+        """
+        locations = locations if locations is not None else SystemLocations()
+        return cls(Subscription(room['room'], locations, room.get('types'), room.get('regions'),
+                                room.get('constellations'), room.get('systems'), room.get('alliances'))
+                   for room in rooms)
+
+    @property
+    def rooms(self):
+        """Every room routed to, in the order they were subscribed."""
+        rooms = []
+        for subscription in self.subscriptions:
+            if subscription.room not in rooms:
+                rooms.append(subscription.room)
+        return rooms
+
+    def resolve(self):
+        """Resolves every subscription's location filters now, e.g. in a thread, instead of when they're first used."""
+        for subscription in self.subscriptions:
+            subscription.systems  # kept once resolved
+
+    def route(self, notification):
+        """Returns the rooms a notification should be announced in, which may be none."""
+        rooms = []
+        for subscription in self.subscriptions:
+            if subscription.room not in rooms and subscription.matches(notification):
+                rooms.append(subscription.room)
+        return rooms
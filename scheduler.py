@@ -0,0 +1,107 @@
+"""Schedules API polls around the cache windows the Eve API reports."""
+import random
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python import log
+from twisted.python.failure import Failure
+
+
+class PollScheduler(object):
+    """
+    Polls each of a set of keys again shortly after the API's cache for it expires, instead of on a fixed interval.
+
+    `poll` is called with a key and should return a Deferred (or a value) giving the number of seconds until the API
+    cache for that key expires, or None if that isn't known, in which case the key is polled again after
+    `default_interval` seconds. Every poll is pushed back by `margin` seconds so it lands after the expiry rather than
+    on it, plus up to `jitter` random seconds so keys don't all hit the API at the same moment. A key is never polled
+    again while its previous poll is still running.
+    """
+    def __init__(self, poll, keys, default_interval, margin=15.0, jitter=60.0, min_interval=60.0, clock=reactor):
+        self.poll = poll
+        self.keys = list(keys)
+        self.default_interval = default_interval
+        self.margin = margin
+        self.jitter = jitter
+        self.min_interval = min_interval
+        self.clock = clock
+        self.running = False
+        self._calls = {}  # key -> IDelayedCall for its next poll
+        self._in_flight = {}  # key -> Deferred for its running poll
+        self._expires = {}  # key -> time the API's cache of its last poll expires
+
+    def start(self):
+        """Polls every key once, spread out over the jitter window, and keeps polling them until stop() is called."""
+        if self.running:
+            return
+        self.running = True
+        for key in self.keys:
+            self._schedule(key, random.uniform(0, self.jitter))
+
+    def stop(self):
+        self.running = False
+        for call in self._calls.itervalues():
+            if call.active():
+                call.cancel()
+        self._calls.clear()
+
+    def poll_now(self, key):
+        """
+        Polls a key right away unless it's already being polled. Returns a Deferred firing with the result of the
+        running poll once it's done; callbacks added to it don't affect anyone else waiting for the same poll.
+        """
+        call = self._calls.pop(key, None)
+        if call is not None and call.active():
+            call.cancel()
+        d = Deferred()
+
+        def finished(result):
+            d.callback(result)
+            return result
+
+        self._run(key).addCallback(finished)
+        return d
+
+    def is_polling(self, key):
+        return key in self._in_flight
+
+    def cache_expires_at(self, key):
+        """Returns the time, in the clock's seconds, the API's cache of a key's last poll expires, or None if unknown."""
+        return self._expires.get(key)
+
+    def next_poll(self, key):
+        """Returns the time, in the clock's seconds, a key is next due to be polled, or None if it isn't scheduled."""
+        call = self._calls.get(key)
+        return call.getTime() if call is not None and call.active() else None
+
+    def _run(self, key):
+        if key in self._in_flight:
+            return self._in_flight[key]
+        d = maybeDeferred(self.poll, key)
+        self._in_flight[key] = d
+        d.addBoth(self._finished, key)
+        return d
+
+    def _finished(self, result, key):
+        del self._in_flight[key]
+        if isinstance(result, Failure):
+            log.err(result, "Unhandled error polling key {}".format(key))
+            result = None
+        expires_in = result if isinstance(result, (int, long, float)) else None
+        if expires_in is None:
+            self._expires.pop(key, None)
+            delay = self.default_interval
+        else:
+            self._expires[key] = self.clock.seconds() + expires_in
+            delay = max(self.min_interval, expires_in + self.margin)
+        delay += random.uniform(0, self.jitter)
+        if self.running:
+            log.msg("Next poll for key {key} in {delay:.0f} seconds.".format(key=key, delay=delay))
+            self._schedule(key, delay)
+        return result
+
+    def _schedule(self, key, delay):
+        self._calls[key] = self.clock.callLater(delay, self._due, key)
+
+    def _due(self, key):
+        self._calls.pop(key, None)
+        self._run(key)
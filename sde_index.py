@@ -0,0 +1,208 @@
+"""
+A compact, memory-mapped id to name index extracted from the Eve Static Data Export.
+
+The bot only ever needs a handful of name columns from the SDE, so update-sde extracts them into one small file
+instead of making the bot bind to the multi-gigabyte dump. The file starts with a magic string and a table count,
+followed by one directory entry per table. Each table is stored as a sorted array of little endian uint32 ids, an array
+of count + 1 uint32 offsets into its names blob, the utf-8 encoded names blob itself, and an array of count * columns
+uint32 values for tables which carry more than a name, e.g. the constellation and region of each solar system. Lookups
+binary search the id array in place, so opening an index costs the same however big it is.
+"""
+from __future__ import with_statement
+import mmap
+import os
+import sqlite3
+import struct
+
+MAGIC = 'SOVSDE\x00\x02'
+_COUNT = struct.Struct('<I')
+_DIRECTORY_ENTRY = struct.Struct('<32sIIQQQQ')
+_UINT32 = struct.Struct('<I')
+
+# Index table name -> query producing (id, name, values...) rows from the SDE dump. Missing values are stored as 0.
+SDE_QUERIES = {'invTypes': 'SELECT typeID, typeName FROM invTypes',
+               'mapSolarSystems': 'SELECT solarSystemID, solarSystemName, constellationID, regionID FROM mapSolarSystems',
+               'mapConstellations': 'SELECT constellationID, constellationName, regionID FROM mapConstellations',
+               'mapRegions': 'SELECT regionID, regionName FROM mapRegions',
+               'mapDenormalize': 'SELECT itemID, itemName, solarSystemID FROM mapDenormalize',
+               'staStations': 'SELECT stationID, stationName FROM staStations'}
+
+
+class SDEIndex(object):
+    """
+    Read-only access to an index file written by build_index(). The file isn't opened until the first lookup or an
+    explicit open(), so a missing index only matters to code which uses it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._tables = {}
+        self._values = {}
+
+    def open(self):
+        """Maps the index file and reads its directory, if that hasn't happened yet. Returns self."""
+        if self._map is not None:
+            return self
+        with open(self.path, 'rb') as f:
+            index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if index_map[:len(MAGIC)] != MAGIC:
+            index_map.close()
+            raise ValueError("{} is not an SDE index file, rerun update-sde.".format(self.path))
+        table_count, = _COUNT.unpack_from(index_map, len(MAGIC))
+        offset = len(MAGIC) + _COUNT.size
+        for _ in xrange(table_count):
+            name, count, columns, ids_offset, name_offsets_offset, names_offset, values_offset = \
+                _DIRECTORY_ENTRY.unpack_from(index_map, offset)
+            self._tables[name.rstrip('\x00')] = (count, ids_offset, name_offsets_offset, names_offset)
+            self._values[name.rstrip('\x00')] = (struct.Struct('<{}I'.format(columns)), values_offset)
+            offset += _DIRECTORY_ENTRY.size
+        # Only once the directory is complete, since the first lookups may come from more than one thread.
+        self._map = index_map
+        return self
+
+    def lookup(self, table, item_id):
+        """Returns the name for an id in the given table, or None if the table doesn't contain it."""
+        count, ids_offset, name_offsets_offset, names_offset = self._table(table)
+        position = self._find(item_id, count, ids_offset)
+        if position is None:
+            return None
+        return self._name_at(position, name_offsets_offset, names_offset)
+
+    def lookup_many(self, table, item_ids):
+        """Returns a dictionary of id -> name for every given id found in the table."""
+        names = {}
+        for item_id in item_ids:
+            name = self.lookup(table, item_id)
+            if name is not None:
+                names[item_id] = name
+        return names
+
+    def values(self, table, item_id):
+        """Returns the tuple of values stored for an id in the given table, or None if the table doesn't contain it."""
+        count, ids_offset, name_offsets_offset, names_offset = self._table(table)
+        position = self._find(item_id, count, ids_offset)
+        if position is None:
+            return None
+        row, values_offset = self._values[table]
+        return row.unpack_from(self._map, values_offset + position * row.size)
+
+    def items_values(self, table):
+        """Yields every (id, values) pair in a table in id order."""
+        count, ids_offset, name_offsets_offset, names_offset = self._table(table)
+        row, values_offset = self._values[table]
+        for position in xrange(count):
+            item_id, = _UINT32.unpack_from(self._map, ids_offset + position * _UINT32.size)
+            yield item_id, row.unpack_from(self._map, values_offset + position * row.size)
+
+    def items(self, table):
+        """Yields every (id, name) pair in a table in id order."""
+        count, ids_offset, name_offsets_offset, names_offset = self._table(table)
+        for position in xrange(count):
+            item_id, = _UINT32.unpack_from(self._map, ids_offset + position * _UINT32.size)
+            yield item_id, self._name_at(position, name_offsets_offset, names_offset)
+
+    def table_size(self, table):
+        return self._table(table)[0]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _table(self, table):
+        if self._map is None:
+            self.open()
+        return self._tables[table]
+
+    def _find(self, item_id, count, ids_offset):
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            middle_id, = _UINT32.unpack_from(self._map, ids_offset + middle * _UINT32.size)
+            if middle_id < item_id:
+                low = middle + 1
+            elif middle_id > item_id:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def _name_at(self, position, name_offsets_offset, names_offset):
+        start, = _UINT32.unpack_from(self._map, name_offsets_offset + position * _UINT32.size)
+        end, = _UINT32.unpack_from(self._map, name_offsets_offset + (position + 1) * _UINT32.size)
+        return self._map[names_offset + start:names_offset + end].decode('utf-8')
+
+
+def build_index(sde_path, index_path, queries=SDE_QUERIES):
+    """
+    Extracts the tables in `queries` from the SDE dump at sde_path and writes them to index_path. The index is written
+    to a temporary file first and renamed into place, so a running bot never sees a half written index.
+    """
+    con = sqlite3.connect(sde_path)
+    try:
+        tables = [(name, _read_table(con, query)) for name, query in sorted(queries.iteritems())]
+    finally:
+        con.close()
+
+    offset = len(MAGIC) + _COUNT.size + len(tables) * _DIRECTORY_ENTRY.size
+    directory = []
+    for name, (ids, name_offsets, names, columns, values) in tables:
+        ids_offset = offset
+        name_offsets_offset = ids_offset + len(ids) * _UINT32.size
+        names_offset = name_offsets_offset + len(name_offsets) * _UINT32.size
+        values_offset = names_offset + len(names)
+        directory.append(_DIRECTORY_ENTRY.pack(name, len(ids), columns, ids_offset, name_offsets_offset, names_offset,
+                                               values_offset))
+        offset = values_offset + len(values) * _UINT32.size
+
+    temporary_path = index_path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_COUNT.pack(len(tables)))
+        for entry in directory:
+            f.write(entry)
+        for name, (ids, name_offsets, names, columns, values) in tables:
+            f.write(struct.pack('<{}I'.format(len(ids)), *ids))
+            f.write(struct.pack('<{}I'.format(len(name_offsets)), *name_offsets))
+            f.write(names)
+            f.write(struct.pack('<{}I'.format(len(values)), *values))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temporary_path, index_path)
+    return {name: len(ids) for name, (ids, name_offsets, names, columns, values) in tables}
+
+
+def is_current(index_path):
+    """Returns whether there's an index at index_path in the format this version of the bot reads."""
+    try:
+        with open(index_path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def _read_table(con, query):
+    """
+    Returns sorted ids, name offsets, the names blob, the number of value columns and the flattened values for an
+    (id, name, values...) query.
+    """
+    cursor = con.execute(query)
+    columns = len(cursor.description) - 2
+    rows = sorted(row for row in cursor if row[0] is not None and row[1] is not None)
+    ids = []
+    name_offsets = [0]
+    names = []
+    values = []
+    length = 0
+    for row in rows:
+        item_id, name = row[:2]
+        for value in (item_id,) + tuple(value or 0 for value in row[2:]):
+            if not 0 <= value <= 0xFFFFFFFF:
+                raise ValueError("{} in row {} doesn't fit in the SDE index.".format(value, item_id))
+        encoded = name.encode('utf-8')
+        ids.append(item_id)
+        names.append(encoded)
+        values.extend(value or 0 for value in row[2:])
+        length += len(encoded)
+        name_offsets.append(length)
+    return ids, name_offsets, ''.join(names), columns, values
@@ -0,0 +1,142 @@
+"""Cached name lookups against the Eve Static Data Export."""
+from bisect import bisect_left
+from collections import OrderedDict
+from models import eve_sde
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """A dictionary which forgets its least recently used keys once it holds more than max_size of them."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SDEResolver(object):
+    """
+    Resolves solar system, type, celestial and station ids to names. Every lookup goes through a bounded LRU cache per
+    table, and ids which aren't in the SDE are cached too so they're only looked up once. Use prefetch() to load every
+    id a batch of notifications refers to in one pass per table before formatting them.
+    """
+    # Resolver table -> SDE index table.
+    tables = {'systems': 'mapSolarSystems',
+              'types': 'invTypes',
+              'items': 'mapDenormalize',
+              'stations': 'staStations'}
+
+    # Tables find() searches by name. Celestials are left out, there are too many of them to keep a name index for.
+    searchable = ('systems', 'stations', 'types')
+
+    def __init__(self, index=eve_sde, max_size=4096):
+        self.index = index
+        self.caches = {table: LRUCache(max_size) for table in self.tables}
+        self._names = None  # (lower case name, table, id) for every searchable row, sorted, built by the first find()
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+
+    def system_name(self, system_id, default='unknown solar system'):
+        return self._lookup('systems', system_id, default)
+
+    def type_name(self, type_id, default='unknown item'):
+        return self._lookup('types', type_id, default)
+
+    def item_name(self, item_id, default='unknown location'):
+        """Names anything in mapDenormalize, e.g. planets and moons."""
+        return self._lookup('items', item_id, default)
+
+    def station_name(self, station_id, default='unknown station'):
+        return self._lookup('stations', station_id, default)
+
+    def prefetch(self, system_ids=(), type_ids=(), item_ids=(), station_ids=()):
+        """Loads every given id which isn't cached yet, using one batch lookup per table."""
+        for table, ids in (('systems', system_ids), ('types', type_ids), ('items', item_ids), ('stations', station_ids)):
+            cache = self.caches[table]
+            self._load(table, set(i for i in (self._coerce(i) for i in ids) if i is not None and i not in cache))
+
+    def find(self, text, limit=5):
+        """
+        Looks up SDE rows by id in every table, or by name in the searchable tables. Names match from their start,
+        ignoring case, and exact matches come first. Returns a list of up to `limit` (table, id, name) tuples.
+        """
+        item_id = self._coerce(text)
+        if item_id is not None:
+            found = [(table, item_id, self.index.lookup(sde_table, item_id)) for table, sde_table in
+                     sorted(self.tables.iteritems())]
+            return [match for match in found if match[2] is not None][:limit]
+        if self._names is None:
+            self._names = sorted((name.lower(), table, name_id) for table in self.searchable
+                                 for name_id, name in self.index.items(self.tables[table]))
+        text = text.strip().lower()
+        start = bisect_left(self._names, (text,))
+        matches = []
+        for name, table, name_id in self._names[start:]:
+            if not name.startswith(text):
+                break
+            matches.append((name != text, len(name), table, name_id))
+        return [(table, name_id, self._lookup(table, name_id, None)) for exact, length, table, name_id in
+                sorted(matches)[:limit]]
+
+    def stats(self):
+        """Returns cache counters as a dictionary, e.g. for logging."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'queries': self.queries,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'cached': {table: len(cache) for table, cache in self.caches.iteritems()}}
+
+    def _lookup(self, table, item_id, default):
+        item_id = self._coerce(item_id)
+        if item_id is None:
+            return default
+        cache = self.caches[table]
+        name = cache.get(item_id, _MISSING)
+        if name is _MISSING:
+            self.misses += 1
+            self._load(table, set([item_id]))
+            name = cache.get(item_id)
+        else:
+            self.hits += 1
+        return name if name is not None else default
+
+    def _load(self, table, ids):
+        if not ids:
+            return
+        cache = self.caches[table]
+        self.queries += 1
+        names = self.index.lookup_many(self.tables[table], ids)
+        for item_id in ids:
+            cache[item_id] = names.get(item_id)
+
+    @staticmethod
+    def _coerce(item_id):
+        try:
+            return int(item_id)
+        except (TypeError, ValueError):
+            return None
+
+
+# A resolver shared by every formatter so its caches survive from one notifications cycle to the next.
+shared_resolver = SDEResolver()
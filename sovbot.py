@@ -1,40 +1,134 @@
 """SovBot: An Eve bot that spams notifications from the Eve API"""
 
+import time
+STARTED = time.time()  # before the other imports, so the startup profile includes them
+
 import logging
-import settings
+import os
+from collections import Counter, OrderedDict
+from datetime import timedelta
+from functools import partial
+from eve_api import EveAPI
+from metrics import SIZE_BOUNDS, Metrics, StartupProfile, listen_metrics
+from models import Notification, configure_sovbot_db, eve_sde, open_sovbot_db, vacuum_sovbot_db
+from name_cache import NameCache
 from notification_set import NotificationSet
+from outbox import Outbox
+from routing import Router
+from scheduler import PollScheduler
+from sde_resolver import LRUCache, shared_resolver
+from spool import Spool
+from workers import WorkerPool
 from twisted.python import log
 from twisted.internet import reactor
-from twisted.internet.defer import Deferred
-from twisted.internet import task
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
+from twisted.internet.defer import (Deferred, DeferredList, DeferredLock, DeferredSemaphore, gatherResults,
+                                    maybeDeferred, succeed)
 from twisted.words.protocols.jabber.jid import JID
 from wokkel.client import XMPPClient
 from wokkel.muc import MUCClient
 
 
 
-THIS_JID = JID(settings.jid)
-ROOM_JID = JID(settings.room)
-NICKNAME = settings.nickname
-PASSWORD = settings.password
-LOG_TRAFFIC = settings.log_traffic
-TASK_INTERVAL = settings.task_interval
-KEY_ID = settings.keyid
-VCODE = settings.vcode
-SELECTED_TYPES = settings.selected_types
+def load_settings():
+    """
+    Reads settings.py into the module's settings constants. main() calls it before anything uses them, so importing
+    this module doesn't need a settings.py.
+    """
+    import settings
+    globals().update(
+        THIS_JID=JID(settings.jid),
+        # Rooms and the notifications each one gets, the single `room` gets everything if no `rooms` are configured.
+        ROOMS=[dict(room, room=JID(room['room']))
+               for room in getattr(settings, 'rooms', None) or [{'room': settings.room}]],
+        NICKNAME=settings.nickname,
+        PASSWORD=settings.password,
+        LOG_TRAFFIC=settings.log_traffic,
+        TASK_INTERVAL=settings.task_interval,
+        POLL_MARGIN=getattr(settings, 'poll_margin', 15.0),
+        POLL_JITTER=getattr(settings, 'poll_jitter', 60.0),
+        API_KEYS=getattr(settings, 'api_keys', None) or [{'keyid': settings.keyid, 'vcode': settings.vcode}],
+        KEY_PARALLELISM=getattr(settings, 'key_parallelism', 4),
+        SELECTED_TYPES=settings.selected_types,
+        API_ROOT=getattr(settings, 'api_root', 'https://api.eveonline.com'),
+        API_TIMEOUT=getattr(settings, 'api_timeout', 30.0),
+        API_PARALLELISM=getattr(settings, 'api_parallelism', 4),
+        API_CHUNK_SIZE=getattr(settings, 'api_chunk_size', 250),
+        SQLITE_JOURNAL_MODE=getattr(settings, 'sqlite_journal_mode', 'WAL'),
+        SQLITE_SYNCHRONOUS=getattr(settings, 'sqlite_synchronous', 'NORMAL'),
+        BODY_DECODER_THREADS=getattr(settings, 'body_decoder_threads', 4),
+        NAME_CACHE_TTL=timedelta(seconds=getattr(settings, 'name_cache_ttl', 7 * 24 * 3600)),
+        SEND_RATE=getattr(settings, 'send_rate', 2.0),
+        SEND_BURST=getattr(settings, 'send_burst', 5),
+        SEND_BATCH_SIZE=getattr(settings, 'send_batch_size', 1),
+        ALERT_GROUP_WINDOW=timedelta(seconds=getattr(settings, 'alert_group_window', 15 * 60)),
+        METRICS_INTERVAL=getattr(settings, 'metrics_interval', 3600.0),
+        METRICS_PORT=getattr(settings, 'metrics_port', None),
+        LOG_PAYLOADS=getattr(settings, 'log_payloads', 0.0),
+        RETENTION_DAYS=getattr(settings, 'retention_days', 30),
+        RETENTION_INTERVAL=getattr(settings, 'retention_interval', 6 * 3600.0),
+        SEEN_FILTER=getattr(settings, 'seen_filter', True),
+        COMMAND_PREFIX=getattr(settings, 'command_prefix', '!'),
+        # Relative to this file, like sovbot.sqlite, rather than to the working directory.
+        SPOOL_PATH=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                getattr(settings, 'spool_path', 'sovbot.spool')),
+        SPOOL_SYNC_INTERVAL=getattr(settings, 'spool_sync_interval', 1.0),
+        WORKERS=getattr(settings, 'workers', 0))
+
+# What the tables SDEResolver.find() searches hold, for lookup replies.
+SDE_TABLE_LABELS = {'systems': 'solar system', 'types': 'type', 'items': 'celestial', 'stations': 'station'}
 
 
 class SovBot(MUCClient):
-    """Joins a room and announces selected notifications every 30 minutes."""
+    """Joins its rooms and announces selected notifications as soon as the Eve API's cache lets us see them."""
 
-    def __init__(self, room_jid, nick):
+    def __init__(self, rooms, nick, startup=None):
         MUCClient.__init__(self)
-        self.room_jid = room_jid
+        self.router = Router.from_settings(rooms)
         self.nick = nick
-        self.looping_task = task.LoopingCall(self.notifications_task)
+        self.api = EveAPI(timeout=API_TIMEOUT, max_connections=API_PARALLELISM, chunk_size=API_CHUNK_SIZE,
+                          root=API_ROOT)
+        self.name_cache = NameCache(ttl=NAME_CACHE_TTL)
+        self.sent_fingerprints = LRUCache(10000)  # events announced recently, used to drop copies from other keys
+        self.keys = OrderedDict((self._key_label(key), key) for key in API_KEYS)
+        self.key_semaphore = DeferredSemaphore(KEY_PARALLELISM)
+        self.delivery_lock = DeferredLock()
+        self.outbox = Outbox(self.groupChat, rate=SEND_RATE, burst=SEND_BURST, batch_size=SEND_BATCH_SIZE)
+        self.spool = Spool(SPOOL_PATH, sync_interval=SPOOL_SYNC_INTERVAL)
+        configured = set(room_jid.full() for room_jid in self.router.rooms)
+        dropped = Counter(room for entry_id, room, message in self.spool.retain(configured))
+        for room, count in dropped.iteritems():
+            log.msg("Dropped {count} spooled messages for {room}, which isn't configured anymore.".format(
+                count=count, room=room))
+        self.joined_rooms = set()  # full JIDs of the rooms joined since we last connected
+        self.warmed = False  # whether the caches have been warmed, which happens once the rooms are first joined
+        self.startup = startup if startup is not None else StartupProfile()
+        self.api_failing = False
+        self.last_success = None
+        self.last_failure = None
+        self.forced_check = None  # while a check started by the check command runs, Deferreds of askers who joined it
+        self.commands = {'check': self.check_command, 'status': self.status_command, 'lookup': self.lookup_command}
+        self.retention_call = LoopingCall(self._prune_notifications)
+        self.metrics = Metrics()
+        self.metrics.gauge('sde_cache', shared_resolver.stats)
+        self.metrics.gauge('name_cache', self.name_cache.stats)
+        self.metrics.gauge('outbox', self.outbox.stats)
+        self.metrics.gauge('spool', lambda: {'pending': len(self.spool)})
+        self.metrics.gauge('startup', self.startup.snapshot)
+        self.workers = None  # builds sets in worker processes if WORKERS is set, otherwise they're built here
+        if WORKERS:
+            self.workers = WorkerPool(WORKERS, self.keys.keys(), {'selected_types': SELECTED_TYPES,
+                                                                  'api_root': API_ROOT,
+                                                                  'api_timeout': API_TIMEOUT,
+                                                                  'api_parallelism': API_PARALLELISM,
+                                                                  'api_chunk_size': API_CHUNK_SIZE,
+                                                                  'body_decoder_threads': BODY_DECODER_THREADS})
+            self.metrics.gauge('workers', self.workers.stats)
+        self.scheduler = PollScheduler(self._poll, self.keys.keys(), TASK_INTERVAL, margin=POLL_MARGIN, jitter=POLL_JITTER)
 
     def connectionInitialized(self):
-        """Once authorized, join the room."""
+        """Once authorized, join the rooms, sending each one the messages waiting for it in the spool once we're in."""
         log.msg("Connected...")
 
         def joinedRoom(room):
@@ -45,79 +139,343 @@ class SovBot(MUCClient):
                 return self.configure(room.roomJID, {})
 
         MUCClient.connectionInitialized(self)
-        self.join(self.room_jid, self.nick)
-        log.msg("Joining {}...".format(self.room_jid))
-        log.msg("Start looping task with {} second interval...".format(TASK_INTERVAL))
-        self.looping_task.start(TASK_INTERVAL)
+        joins = []
+        for room_jid in self.router.rooms:
+            d = self.join(room_jid, self.nick)
+            d.addCallback(joinedRoom)
+            d.addCallback(lambda _, room_jid=room_jid: self._flush_spool(room_jid.full()))
+            d.addErrback(log.err, "Joining {} failed, its messages stay spooled".format(room_jid))
+            joins.append(d)
+            log.msg("Joining {}...".format(room_jid))
+        DeferredList(joins, consumeErrors=True).addCallback(self._joined_rooms)
+        log.msg("Start polling {} API keys...".format(len(self.keys)))
+        self.scheduler.start()
+        if METRICS_INTERVAL:
+            self.metrics.start_reporting(METRICS_INTERVAL)
+        if RETENTION_DAYS and not self.retention_call.running:
+            self.retention_call.start(RETENTION_INTERVAL)
+
+    def connectionLost(self, reason):
+        """Stops sending until we've reconnected, the spool still holds every message that hadn't gone out."""
+        log.msg("Disconnected, {} messages are spooled until we reconnect.".format(len(self.spool)))
+        MUCClient.connectionLost(self, reason)
+        self.joined_rooms.clear()
+        self.outbox.clear(reason)
 
     def receivedGroupChat(self, room, user, message):
-        """Handle received groupchat messages."""
-        # handle force-check here
-        pass
-
-    def notifications_task(self):
-        """This function defines the task which reports notifications from the Eve API every TASK_INTERVAL seconds."""
-        log.msg("Starting notifications task...")
-        notification_set = NotificationSet(SELECTED_TYPES, KEY_ID, VCODE)
-        d = Deferred()
-        d.addCallback(self._get_headers)
-        d.addCallback(self._get_texts)
-        d.addCallback(self._build_notifications)
-        d.addCallback(self._fetch_names)
-        d.addCallback(self._send_messages)
+        """
+        Runs commands posted in the room, e.g. '!check', and posts their replies there. Handlers are called with the
+        command's argument and the room's JID, for replies they post while they run.
+        """
+        body = message.body or u''
+        if message.delay is not None or user is None or user.nick == self.nick or not body.startswith(COMMAND_PREFIX):
+            # Ignore the room's history, our own messages and chatter.
+            return
+        command, _, argument = body[len(COMMAND_PREFIX):].strip().partition(u' ')
+        handler = self.commands.get(command.lower())
+        if handler is None:
+            return
+        log.msg("{nick} asked for {command}.".format(nick=user.nick.encode('utf-8'), command=command.encode('utf-8')))
+        d = maybeDeferred(handler, argument.strip(), room.roomJID)
+        d.addCallback(self._reply, room.roomJID)
+        d.addErrback(log.err)
+
+    def check_command(self, argument, room):
+        """
+        Polls every key whose API cache has expired right away. Only one forced check runs at a time, asking again
+        while it runs joins it, and keys the API would only answer from its cache are left alone.
+        """
+        if self.forced_check is not None:
+            self._reply("A check is already running, I'll tell you when it's done.", room)
+            d = Deferred()
+            self.forced_check.append(d)
+            return d
+        now = reactor.seconds()
+        expiry = dict((label, self.scheduler.cache_expires_at(label)) for label in self.keys)
+        due = [label for label, expires_at in expiry.iteritems() if expires_at is None or expires_at <= now]
+        if not due:
+            return "The API won't have anything new for another {}, try again then.".format(
+                self._duration(min(expiry.itervalues()) - now))
+        self._reply("Checking {} API keys...".format(len(due)), room)
+        self.forced_check = []
+
+        def finished(result):
+            joined, self.forced_check = self.forced_check, None
+            reply = "Check finished." if not self.api_failing else None
+            for d in joined:
+                d.callback(reply)
+            return reply
+
+        d = gatherResults([self.scheduler.poll_now(label) for label in due], consumeErrors=True)
+        d.addBoth(finished)
+        return d
+
+    def status_command(self, argument, room):
+        """Reports how polling has been going, the outbox and the caches."""
+        now = reactor.seconds()
+        next_polls = [self.scheduler.next_poll(label) for label in self.keys]
+        next_polls = [next_poll for next_poll in next_polls if next_poll is not None]
+        outbox = self.outbox.stats()
+        sde = shared_resolver.stats()
+        names = self.name_cache.stats()
+        return ("Polling {keys} API keys, last successful check {success}, last failure {failure}, "
+                "next check in {next}. Outbox: {depth} queued, {sent} sent, {spooled} spooled. "
+                "SDE cache: {sde:.0%} hits. Name cache: {names:.0%} hits.").format(
+            keys=len(self.keys),
+            success=self._duration(now - self.last_success) + ' ago' if self.last_success else 'never',
+            failure=self._duration(now - self.last_failure) + ' ago' if self.last_failure else 'never',
+            next=self._duration(min(next_polls) - now) if next_polls else 'a moment',
+            depth=outbox['depth'], sent=outbox['messages'], spooled=len(self.spool), sde=sde['hit_rate'],
+            names=names['hit_rate'])
+
+    def lookup_command(self, argument, room):
+        """Looks up a solar system, station or type by name, or anything in the SDE by id."""
+        if not argument:
+            return "Usage: {}lookup <name or id>".format(COMMAND_PREFIX)
+        matches = shared_resolver.find(argument)
+        if not matches:
+            return u"Nothing in the SDE matches {}.".format(argument)
+        return u', '.join(u'{name} ({label} {id})'.format(name=name, label=SDE_TABLE_LABELS[table], id=item_id)
+                          for table, item_id, name in matches)
+
+    def _reply(self, text, rooms):
+        """Posts a reply in one room, given its JID, or in every one of a list of rooms."""
+        if text:
+            for room_jid in rooms if isinstance(rooms, list) else [rooms]:
+                self.outbox.put(text, room_jid).addErrback(log.err)
+
+    @staticmethod
+    def _duration(seconds):
+        minutes = int(max(0, seconds) // 60)
+        if minutes >= 60:
+            return "{hours}h {minutes}m".format(hours=minutes // 60, minutes=minutes % 60)
+        return "{} minutes".format(minutes) if minutes else "under a minute"
+
+    def _poll(self, key_label):
+        return self.key_semaphore.run(self.notifications_task, self.keys[key_label])
+
+    def notifications_task(self, key):
+        """
+        This function defines the task which reports notifications from the Eve API for one key. It's scheduled by
+        self.scheduler and returns a Deferred firing with the number of seconds until the API's cache of the key's
+        headers expires, which is when the task should run for that key again. With self.workers, the headers, texts and
+        build stages run in the worker process which owns the key.
+        """
+        log.msg("Starting notifications task for key {}...".format(self._key_label(key)))
+        notification_set = NotificationSet(SELECTED_TYPES, key['keyid'], key['vcode'], key.get('character_id'),
+                                           api=self.api, name_cache=self.name_cache, payload_sample_rate=LOG_PAYLOADS)
+        d = succeed(notification_set)
+        if self.workers is not None:
+            d.addCallback(self._timed('worker', partial(self._build_in_worker, key)))
+        else:
+            d.addCallback(self._timed('headers', self._get_headers))
+            d.addCallback(self._timed('texts', self._get_texts))
+            d.addCallback(self._timed('build', self._build_notifications))
+        d.addCallback(self._timed('deliver', partial(self.delivery_lock.run, self._deliver)))
         d.addCallback(self._log_success)
         d.addErrback(self._log_exceptions)
-        d.callback(notification_set)
+        d.addCallback(lambda _: notification_set.cache_expires_in())
+        return d
+
+    def _deliver(self, notification_set):
+        """
+        Announces a built set's new notifications. Deliveries run one at a time under self.delivery_lock and hold it
+        until their messages are spooled, so when several keys report the same event at once the later ones see it was
+        already announced.
+        """
+        d = succeed(notification_set)
+        d.addCallback(self._timed('merge', self._merge_notifications))
+        d.addCallback(self._timed('aggregate', self._aggregate_alerts))
+        d.addCallback(self._timed('names', self._fetch_names))
+        d.addCallback(self._timed('send', self._send_messages))
+        return d
+
+    def _timed(self, stage, step):
+        """Wraps a step of the notifications task so its latency is recorded in the 'stage.<stage>' histogram."""
+        return lambda notification_set: self.metrics.time('stage.' + stage, step, notification_set)
+
+    def _merge_notifications(self, notification_set):
+        log.msg("Dropping notifications already announced through other keys...")
+        return NotificationSet.merge([notification_set], self.sent_fingerprints)
+
+    def _aggregate_alerts(self, notification_set):
+        if ALERT_GROUP_WINDOW:
+            log.msg("Collapsing repeated attack alerts...")
+            notification_set.aggregate_alerts(ALERT_GROUP_WINDOW)
+        return notification_set
 
     def _get_headers(self, notification_set):
         log.msg("Fetching headers from API...")
-        notification_set.get_headers_xml()
-        return notification_set
+        d = notification_set.get_headers_xml()
+        d.addCallback(self._record_size, notification_set, 'headers')
+        return d
 
     def _get_texts(self, notification_set):
         log.msg("Fetching texts from API...")
-        notification_set.get_texts_xml()
-        return notification_set
+        d = notification_set.get_texts_xml()
+        d.addCallback(self._record_size, notification_set, 'texts')
+        return d
 
     def _build_notifications(self, notification_set):
         log.msg("Building notifications...")
-        notification_set.build_notifications()
-        return notification_set
+        d = notification_set.build_notifications()
+        d.addCallback(lambda _: notification_set)
+        return d
+
+    def _build_in_worker(self, key, notification_set):
+        log.msg("Building notifications in a worker...")
+        d = self.workers.build(self._key_label(key), key)
+        d.addCallback(notification_set.load_built_state)
+        d.addCallback(self._record_size, notification_set, 'headers')
+        d.addCallback(self._record_size, notification_set, 'texts')
+        return d
 
-    def _fetch_names(selfself, notification_set):
+    def _fetch_names(self, notification_set):
         log.msg("Fetching character names...")
-        notification_set.fetch_character_names()
+        d = notification_set.fetch_character_names()
+        d.addCallback(self._record_size, notification_set, 'names')
+        return d
+
+    def _record_size(self, _, notification_set, response):
+        if notification_set.response_bytes[response]:
+            self.metrics.observe('bytes.' + response, notification_set.response_bytes[response], SIZE_BOUNDS)
         return notification_set
 
     def _send_messages(self, notification_set):
-        log.msg("Sending notification messages...")
-        for message in reversed(notification_set.get_messages()):
-            body = message
-            self.groupChat(self.room_jid, body)
+        """
+        Spools the messages for every room their notification is routed to, puts the ones for rooms we've joined in the
+        outbox, then records the notifications as sent. The spool is on disk before anything is recorded, so a message
+        which doesn't go out now is sent after we reconnect or restart instead of being lost.
+        """
+        log.msg("Spooling notification messages...")
+        entries = []
+        handled = []
+        unrouted = 0
+        for notification, message in reversed(notification_set.get_messages()):
+            rooms = self.router.route(notification)
+            if not rooms:
+                # No room wants it, but it's been dealt with all the same.
+                unrouted += 1
+            entries.extend((room_jid.full(), message) for room_jid in rooms)
+            handled.append(notification)
+        spooled = self.spool.add(entries)
+        for entry_id, room, message in spooled:
+            if room in self.joined_rooms:
+                self._send_spooled(entry_id, room, message)
+        notification_set.mark_sent(handled)
+        self.metrics.increment('messages.spooled', len(spooled))
+        self.metrics.increment('messages.unrouted', unrouted)
         return notification_set
 
+    def _joined_rooms(self, _):
+        if not self.warmed:
+            self.warmed = True
+            self.startup.mark('connect')
+            d = self._warm_caches()
+            d.addCallback(lambda _: self.startup.mark('warm caches'))
+            d.addErrback(log.err, "Warming the caches failed")
+            d.addCallback(lambda _: self.startup.report())
+
+    def _warm_caches(self):
+        """
+        Loads in a thread what the first cycles would otherwise wait for: the ids of sent notifications, if SEEN_FILTER
+        is on, the SDE index and the solar systems the rooms' location filters cover. Until then new ids are checked
+        against the database, and the index and the filters are read on first use.
+        """
+        def warm():
+            if SEEN_FILTER:
+                log.msg("Loaded {} sent notification ids.".format(Notification.load_seen_ids()))
+            eve_sde.open()
+            self.router.resolve()
+
+        return deferToThread(warm)
+
+    def _flush_spool(self, room):
+        """Sends every spooled message for a room which hasn't gone out yet, oldest first, now that we're in it."""
+        self.joined_rooms.add(room)
+        pending = [(entry_id, message) for entry_id, (to, message) in self.spool.pending.iteritems() if to == room]
+        if pending:
+            log.msg("Sending {count} spooled messages to {room}...".format(count=len(pending), room=room))
+        for entry_id, message in pending:
+            self._send_spooled(entry_id, room, message)
+
+    def _send_spooled(self, entry_id, room, message):
+        def sent(_):
+            self.spool.ack(entry_id)
+            self.metrics.increment('messages.sent')
+
+        def failed(failure):
+            # It stays in the spool and is sent again once we've reconnected.
+            if room not in self.joined_rooms:
+                return  # dropped from the outbox by connectionLost()
+            self.metrics.increment('messages.failed')
+            log.msg("Failed to send a message: {}".format(failure.getErrorMessage()))
+
+        self.outbox.put(message, JID(room)).addCallbacks(sent, failed)
+
+    def _prune_notifications(self):
+        """Deletes sent notifications which the API can no longer return and hands their space back."""
+        try:
+            pruned = Notification.prune(timedelta(days=RETENTION_DAYS))
+            freed = vacuum_sovbot_db()
+        except Exception:
+            log.err(None, "Pruning sent notifications failed")
+        else:
+            log.msg("Pruned {pruned} notifications older than {days} days, freed {pages} database pages.".format(
+                pruned=pruned, days=RETENTION_DAYS, pages=freed))
+
     def _log_success(self, notification_set):
         log.msg("Task finished successfully.")
+        self.last_success = reactor.seconds()
+        self.metrics.increment('tasks.succeeded')
+        self.api_failing = False
         return True
 
     def _log_exceptions(self, failure):
         log.msg("Exception:{}".format(failure.getErrorMessage()))
         log.msg("Traceback:{}".format(failure.getTraceback()))
-        body = "Is it just me, or is the internet on fire?"
-        self.groupChat(self.room_jid, body)
+        self.metrics.increment('tasks.failed')
+        self.last_failure = reactor.seconds()
+        if not self.api_failing:
+            # Only complain once per outage rather than once per key per cycle.
+            self.api_failing = True
+            body = "Is it just me, or is the internet on fire?"
+            self._reply(body, self.router.rooms)
+
+    @staticmethod
+    def _key_label(key):
+        if key.get('character_id'):
+            return '{}:{}'.format(key['keyid'], key['character_id'])
+        return str(key['keyid'])
 
 
 if __name__ == "__main__":
+    # Everything up to joining the rooms is kept to the minimum, the rest is loaded in the background once we're in.
+    startup = StartupProfile(STARTED)
+    startup.mark('imports')
+    with startup.phase('settings'):
+        load_settings()
+
     # set up logging.
     FORMAT = '%(asctime)s :: %(message)s'
     logging.basicConfig(filename='sovbot.log', format=FORMAT, level=logging.INFO)
     observer = log.PythonLoggingObserver(loggerName='sovbot')
     observer.start()
 
+    with startup.phase('database'):
+        open_sovbot_db()
+        configure_sovbot_db(SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS)
+    reactor.suggestThreadPoolSize(BODY_DECODER_THREADS)
+
     # set up client.
-    client = XMPPClient(THIS_JID, PASSWORD)
-    client.logTraffic = LOG_TRAFFIC
-    mucHandler = SovBot(ROOM_JID, NICKNAME)
-    mucHandler.setHandlerParent(client)
+    with startup.phase('client'):
+        client = XMPPClient(THIS_JID, PASSWORD)
+        client.logTraffic = LOG_TRAFFIC
+        mucHandler = SovBot(ROOMS, NICKNAME, startup)
+        mucHandler.setHandlerParent(client)
+        if METRICS_PORT:
+            listen_metrics(mucHandler.metrics, METRICS_PORT)
+        if mucHandler.workers is not None:
+            reactor.addSystemEventTrigger('before', 'shutdown', mucHandler.workers.stop)
     client.startService()
     reactor.run()
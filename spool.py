@@ -0,0 +1,117 @@
+"""A durable queue of outgoing messages, so alerts survive disconnects and restarts until they've been sent."""
+import json
+import os
+from collections import OrderedDict
+from twisted.internet import reactor
+from twisted.python import log
+
+
+class Spool(object):
+    """
+    An append-only file of messages waiting to be sent. Each line is a JSON record, either a message with its id and
+    destination or the acknowledgement of an id which has been sent. Adding messages costs one write and one fsync
+    however many are added at once. Acknowledgements are only fsynced every `sync_interval` seconds, since losing
+    one just means a message is sent twice. Once `compact_after` acknowledgements have piled up the file is rewritten
+    with only the pending messages, which also happens whenever a spool is opened.
+    """
+    def __init__(self, path, sync_interval=1.0, compact_after=1000, clock=reactor):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.compact_after = compact_after
+        self.clock = clock
+        self.pending = OrderedDict()  # id -> (destination, message), oldest first
+        self._next_id = 1
+        self._acknowledged = 0  # acknowledgements in the file
+        self._sync_call = None
+        self._file = None
+        self._load()
+        self._compact()
+
+    def add(self, entries):
+        """
+        Appends (destination, message) entries and fsyncs them. Returns a list of (id, destination, message) tuples for
+        the entries, in the same order.
+        """
+        added = []
+        for destination, message in entries:
+            added.append((self._next_id, destination, message))
+            self.pending[self._next_id] = (destination, message)
+            self._next_id += 1
+        if added:
+            self._file.write(''.join(json.dumps({'id': entry_id, 'to': destination, 'message': message}) + '\n'
+                                     for entry_id, destination, message in added))
+            self.sync()
+        return added
+
+    def ack(self, entry_id):
+        """Records that a message has been sent, so it won't be sent again."""
+        if self.pending.pop(entry_id, None) is None:
+            return
+        self._file.write(json.dumps({'ack': entry_id}) + '\n')
+        self._acknowledged += 1
+        if self._acknowledged >= self.compact_after:
+            self._compact()
+        elif self._sync_call is None:
+            self._sync_call = self.clock.callLater(self.sync_interval, self.sync)
+
+    def retain(self, destinations):
+        """
+        Drops the pending messages for any destination not in `destinations`, e.g. rooms which were removed from the
+        settings, and rewrites the file without them. Returns a list of (id, destination, message) tuples for the
+        messages dropped.
+        """
+        dropped = [(entry_id, destination, message) for entry_id, (destination, message) in self.pending.iteritems()
+                   if destination not in destinations]
+        if dropped:
+            for entry_id, destination, message in dropped:
+                del self.pending[entry_id]
+            self._compact()
+        return dropped
+
+    def sync(self):
+        """Flushes everything written to the spool to disk."""
+        if self._sync_call is not None and self._sync_call.active():
+            self._sync_call.cancel()
+        self._sync_call = None
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash mid-write. Anything after it was never fsynced either.
+                    log.msg("Ignoring a damaged line in the spool {}.".format(self.path))
+                    continue
+                if 'ack' in record:
+                    self.pending.pop(record['ack'], None)
+                else:
+                    self.pending[record['id']] = (record['to'], record['message'])
+                    self._next_id = max(self._next_id, record['id'] + 1)
+
+    def _compact(self):
+        """Rewrites the file with only the pending messages, renaming the new file into place once it's on disk."""
+        if self._file is not None:
+            self._file.close()
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            for entry_id, (destination, message) in self.pending.iteritems():
+                f.write(json.dumps({'id': entry_id, 'to': destination, 'message': message}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temporary_path, self.path)
+        self._acknowledged = 0
+        self._file = open(self.path, 'ab')
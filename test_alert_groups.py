@@ -0,0 +1,56 @@
+"""Tests for collapsing attack alerts into groups, run with `python -m unittest test_alert_groups`."""
+import unittest
+from datetime import datetime, timedelta
+from alert_groups import group_alerts
+from models import Notification
+from notification_record import NotificationRecord
+from notification_set import NotificationSet
+from test_models import DatabaseTest
+
+
+def alert(notification_id, minute):
+    """A TCU attack alert in Jita sent `minute` minutes past noon."""
+    notification = NotificationRecord(notification_id, 86, datetime(2015, 8, 1, 12, minute))
+    notification.set_body({'solarSystemID': 30000142, 'aggressorID': 1, 'shieldValue': 0.5})
+    return notification
+
+
+class GroupAlertsTest(unittest.TestCase):
+    def setUp(self):
+        self.alerts = [alert(1, 0), alert(2, 10), alert(3, 20), alert(4, 30)]
+
+    def test_default_window(self):
+        groups = group_alerts(self.alerts)
+        self.assertEqual([[n.id for n in group.notifications] for group in groups], [[1, 2], [3, 4]])
+
+    def test_window(self):
+        groups = group_alerts(self.alerts, timedelta(minutes=45))
+        self.assertEqual([[n.id for n in group.notifications] for group in groups], [[1, 2, 3, 4]])
+
+
+class AggregateAlertsTest(DatabaseTest):
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.notification_set = NotificationSet({'86': ''}, None, None, api=object(), name_cache=object())
+        for notification in [alert(4, 30), alert(3, 20), alert(2, 10), alert(1, 0)]:
+            self.notification_set._notifications[notification.id] = notification
+
+    def test_window_is_used(self):
+        self.notification_set.aggregate_alerts(timedelta(minutes=45))
+        self.assertEqual(list(self.notification_set._notifications), [4])
+        self.assertEqual(sorted(n.id for n in self.notification_set._duplicates[4]), [1, 2, 3])
+
+    def test_short_window(self):
+        self.notification_set.aggregate_alerts(timedelta(minutes=5))
+        self.assertEqual(list(self.notification_set._notifications), [4, 3, 2, 1])
+        self.assertEqual(self.notification_set._groups, {})
+
+    def test_sent_alerts_are_left_alone(self):
+        Notification.record_sent([alert(4, 30)])
+        self.notification_set.aggregate_alerts(timedelta(minutes=45))
+        self.assertEqual(list(self.notification_set._notifications), [4, 3])
+        self.assertEqual(sorted(n.id for n in self.notification_set._duplicates[3]), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Tests for the sovbot database, run with `python -m unittest test_models`."""
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from pony.orm import db_session
+from models import Notification, SeenIds, configure_sovbot_db, open_sovbot_db, seen_ids, sovbot_db
+from notification_record import NotificationRecord
+
+
+def open_test_db():
+    """Binds the models to a temporary database, once per test run, so tests never touch sovbot.sqlite."""
+    if sovbot_db.provider is None:
+        directory = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, directory)
+        open_sovbot_db(os.path.join(directory, 'sovbot.sqlite'))
+
+
+def synchronous_level():
+    with db_session:
+        return sovbot_db.get_connection().execute('PRAGMA synchronous').fetchone()[0]
+
+
+def sent(notification_id, day):
+    """A notification sent at noon on `day` August 2015."""
+    return NotificationRecord(notification_id, 86, datetime(2015, 8, day, 12, 0))
+
+
+class DatabaseTest(unittest.TestCase):
+    """Starts every test with an empty Notification table and seen_ids not loaded."""
+    def setUp(self):
+        open_test_db()
+        seen_ids.__init__()
+        with db_session:
+            sovbot_db.execute('DELETE FROM "Notification"')
+
+
+class ConfigureTest(DatabaseTest):
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        configure_sovbot_db('WAL', 'NORMAL')
+
+    def test_queries_after_configuring(self):
+        self.assertEqual(Notification.new_ids([1]), set([1]))
+        Notification.record_sent([sent(1, 1)])
+        self.assertEqual(Notification.new_ids([1, 2]), set([2]))
+
+    def test_level_on_every_thread(self):
+        levels = [synchronous_level()]
+        thread = threading.Thread(target=lambda: levels.append(synchronous_level()))
+        thread.start()
+        thread.join()
+        # 1 is NORMAL, where SQLite's default is FULL.
+        self.assertEqual(levels, [1, 1])
+
+
+class SeenIdsTest(unittest.TestCase):
+    def test_unused_until_loaded(self):
+        ids = SeenIds()
+        ids.add([1, 2])
+        self.assertNotIn(1, ids)
+        self.assertEqual(len(ids), 0)
+
+    def test_add_and_discard(self):
+        ids = SeenIds(merge_after=2)
+        ids.load([5, 3, 9])
+        ids.add([1, 3, 7])
+        self.assertEqual([i for i in range(10) if i in ids], [1, 3, 5, 7, 9])
+        self.assertEqual(len(ids), 5)
+        ids.add([2, 4])  # past merge_after, so everything is merged into the array
+        self.assertEqual(list(ids._ids), [1, 2, 3, 4, 5, 7, 9])
+        ids.discard([1, 4, 8])
+        self.assertEqual([i for i in range(10) if i in ids], [2, 3, 5, 7, 9])
+        self.assertEqual(len(ids), 5)
+
+
+class RetentionTest(DatabaseTest):
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        Notification.record_sent([sent(1, 1), sent(2, 9), sent(3, 20)])
+
+    def test_prune(self):
+        pruned = Notification.prune(timedelta(days=15), now=datetime(2015, 8, 25, 12, 0))
+        self.assertEqual(pruned, 2)
+        self.assertEqual(Notification.new_ids([1, 2, 3]), set([1, 2]))
+
+    def test_prune_seen_ids(self):
+        self.assertEqual(Notification.load_seen_ids(), 3)
+        Notification.prune(timedelta(days=15), now=datetime(2015, 8, 25, 12, 0))
+        self.assertEqual([i for i in (1, 2, 3) if i in seen_ids], [3])
+
+    def test_seen_ids_answer_without_the_database(self):
+        Notification.load_seen_ids()
+        Notification.record_sent([sent(4, 21)])
+        with db_session:
+            sovbot_db.execute('DELETE FROM "Notification"')
+        self.assertEqual(Notification.new_ids([1, 4, 5]), set([5]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Tests for merging the notifications of several API keys, run with `python -m unittest test_notification_set`."""
+import unittest
+from datetime import datetime
+from models import Notification
+from notification_record import NotificationRecord
+from notification_set import NotificationSet
+from test_models import DatabaseTest
+
+
+def alert(notification_id, minute, structure=1):
+    """An attack alert on `structure` in Jita sent `minute` minutes past noon."""
+    notification = NotificationRecord(notification_id, 86, datetime(2015, 8, 1, 12, minute))
+    notification.set_body({'solarSystemID': 30000142, 'aggressorID': 1, 'itemID': structure})
+    return notification
+
+
+def notification_set(*notifications):
+    built = NotificationSet({'86': ''}, None, None, api=object(), name_cache=object())
+    for notification in notifications:
+        built._notifications[notification.id] = notification
+    return built
+
+
+class MergeTest(DatabaseTest):
+    def test_copies_from_other_keys(self):
+        merged = NotificationSet.merge([notification_set(alert(1, 0), alert(2, 5)),
+                                        notification_set(alert(11, 0), alert(12, 5, structure=2))])
+        self.assertEqual(list(merged._notifications), [12, 2, 11])
+        self.assertEqual([n.id for n in merged._duplicates[11]], [1])
+
+    def test_copies_are_recorded_with_the_one_sent(self):
+        merged = NotificationSet.merge([notification_set(alert(1, 0)), notification_set(alert(11, 0))])
+        merged.mark_sent([merged._notifications[11]])
+        self.assertEqual(Notification.new_ids([1, 11]), set())
+
+    def test_copies_in_later_cycles(self):
+        sent_fingerprints = {}
+        merged = NotificationSet.merge([notification_set(alert(1, 0))], sent_fingerprints)
+        merged.mark_sent(merged._notifications.values())
+        # Another key reports the same event a cycle later, under its own id.
+        later = NotificationSet.merge([notification_set(alert(1, 0)), notification_set(alert(11, 0))],
+                                      sent_fingerprints)
+        self.assertEqual(list(later._notifications), [1])
+        self.assertEqual([n.id for n in later._suppressed], [11])
+        later.mark_sent([])
+        self.assertEqual(Notification.new_ids([11]), set())
+
+    def test_already_sent_notifications_are_kept(self):
+        Notification.record_sent([alert(1, 0)])
+        merged = NotificationSet.merge([notification_set(alert(1, 0)), notification_set(alert(11, 0))])
+        self.assertEqual(list(merged._notifications), [11, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""Tests for pacing room messages, run with `python -m unittest test_outbox`."""
+import unittest
+from twisted.internet.task import Clock
+from outbox import Outbox
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.sent = []  # (destination, stanza, time)
+
+    def send(self, destination, stanza):
+        self.sent.append((destination, stanza, self.clock.seconds()))
+
+    def test_burst_then_paced(self):
+        outbox = Outbox(self.send, rate=2.0, burst=3, clock=self.clock)
+        for i in range(6):
+            outbox.put(str(i), 'room')
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(outbox.depth(), 3)
+        self.clock.advance(0.5)
+        self.assertEqual(len(self.sent), 4)
+        self.clock.pump([0.5, 0.5])
+        self.assertEqual([stanza for destination, stanza, sent in self.sent], ['0', '1', '2', '3', '4', '5'])
+        self.assertEqual([sent for destination, stanza, sent in self.sent], [0, 0, 0, 0.5, 1.0, 1.5])
+        self.assertEqual(outbox.stats()['max_latency'], 1.5)
+
+    def test_tokens_refill(self):
+        outbox = Outbox(self.send, rate=1.0, burst=2, clock=self.clock)
+        outbox.put('a')
+        outbox.put('b')
+        self.clock.advance(10)
+        outbox.put('c')
+        outbox.put('d')
+        self.assertEqual([sent for destination, stanza, sent in self.sent], [0, 0, 10, 10])
+
+    def test_batches_by_destination(self):
+        outbox = Outbox(self.send, rate=1.0, burst=1, batch_size=3, clock=self.clock)
+        outbox.put('first', 'room1')
+        for message, destination in [('a', 'room1'), ('b', 'room1'), ('c', 'room2'), ('d', 'room2')]:
+            outbox.put(message, destination)
+        self.clock.pump([1, 1])
+        self.assertEqual([(destination, stanza) for destination, stanza, sent in self.sent],
+                         [('room1', 'first'), ('room1', 'a\nb'), ('room2', 'c\nd')])
+        self.assertEqual(outbox.stats()['stanzas'], 3)
+        self.assertEqual(outbox.stats()['messages'], 5)
+
+    def test_stanza_length(self):
+        outbox = Outbox(self.send, rate=1.0, burst=1, batch_size=10, max_stanza_length=7, clock=self.clock)
+        outbox.put('first')
+        for message in ['abc', 'def', 'ghi']:
+            outbox.put(message)
+        self.clock.pump([1, 1])
+        self.assertEqual([stanza for destination, stanza, sent in self.sent], ['first', 'abc\ndef', 'ghi'])
+
+    def test_failed_send(self):
+        def send(destination, stanza):
+            raise IOError("Not connected")
+        outbox = Outbox(send, clock=self.clock)
+        failures = []
+        outbox.put('a').addErrback(failures.append)
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(failures[0].check(IOError))
+        self.assertEqual(outbox.stats()['failed'], 1)
+
+    def test_clear(self):
+        outbox = Outbox(self.send, rate=1.0, burst=1, clock=self.clock)
+        results = []
+        for message in ['a', 'b', 'c']:
+            outbox.put(message).addBoth(results.append)
+        outbox.clear(ValueError("Connection lost"))
+        self.clock.advance(10)
+        self.assertEqual(results[0], 'a')
+        self.assertTrue(all(result.check(ValueError) for result in results[1:]))
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(outbox.depth(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
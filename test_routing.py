@@ -0,0 +1,61 @@
+"""Tests for routing notifications to rooms, run with `python -m unittest test_routing`."""
+import unittest
+from datetime import datetime
+from notification_record import NotificationRecord
+from routing import Router, SystemLocations
+
+JITA, PERIMETER, ONE_DQ = 30000142, 30000144, 30004759
+KIMOTORO, DELVE = 20000020, 10000060
+
+
+class FakeIndex(object):
+    """Stands in for the SDE index with a few systems, counting the reads of mapSolarSystems."""
+    tables = {'mapSolarSystems': [(JITA, 'Jita', (KIMOTORO, 10000002)), (PERIMETER, 'Perimeter', (KIMOTORO, 10000002)),
+                                  (ONE_DQ, '1DQ1-A', (20000696, DELVE))],
+              'mapRegions': [(DELVE, 'Delve', ())]}
+
+    def __init__(self):
+        self.reads = 0
+
+    def items(self, table):
+        return [(item_id, name) for item_id, name, values in self.tables[table]]
+
+    def items_values(self, table):
+        self.reads += 1
+        return [(item_id, values) for item_id, name, values in self.tables[table]]
+
+
+def alert(system):
+    notification = NotificationRecord(1, 86, datetime(2015, 8, 1, 12, 0))
+    notification.set_body({'solarSystemID': system, 'aggressorID': 1, 'aggressorAllianceID': 99})
+    return notification
+
+
+class RouterTest(unittest.TestCase):
+    def setUp(self):
+        self.index = FakeIndex()
+        self.router = Router.from_settings([{'room': 'all'},
+                                            {'room': 'delve', 'regions': ['Delve']},
+                                            {'room': 'kimotoro', 'constellations': [KIMOTORO], 'types': [75]},
+                                            {'room': 'allies', 'alliances': [99]}],
+                                           SystemLocations(self.index))
+
+    def test_route(self):
+        self.assertEqual(self.router.route(alert(ONE_DQ)), ['all', 'delve', 'allies'])
+        self.assertEqual(self.router.route(alert(JITA)), ['all', 'allies'])
+
+    def test_locations_resolved_on_first_use(self):
+        self.assertEqual(self.index.reads, 0)
+        self.router.route(alert(JITA))
+        self.router.route(alert(PERIMETER))
+        self.assertEqual(self.index.reads, 1)
+
+    def test_resolve(self):
+        self.router.resolve()
+        self.assertEqual(self.index.reads, 1)
+        self.assertEqual(self.router.subscriptions[1].systems, frozenset([ONE_DQ]))
+        self.assertEqual(self.router.subscriptions[0].systems, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Tests for scheduling polls around the API's cache windows, run with `python -m unittest test_scheduler`."""
+import unittest
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+from scheduler import PollScheduler
+
+
+class PollSchedulerTest(SynchronousTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.polls = []  # (key, Deferred) for each poll started
+        self.scheduler = PollScheduler(self.poll, ['a', 'b'], 1800, margin=15, jitter=0, min_interval=60,
+                                       clock=self.clock)
+
+    def poll(self, key):
+        d = Deferred()
+        self.polls.append((key, d))
+        return d
+
+    def test_polls_after_the_cache_expires(self):
+        self.scheduler.start()
+        self.clock.advance(0)
+        self.assertEqual([key for key, d in self.polls], ['a', 'b'])
+        self.polls[0][1].callback(600)
+        self.assertEqual(self.scheduler.cache_expires_at('a'), 600)
+        self.assertEqual(self.scheduler.next_poll('a'), 615)
+        self.clock.advance(614)
+        self.assertEqual(len(self.polls), 2)
+        self.clock.advance(1)
+        self.assertEqual([key for key, d in self.polls], ['a', 'b', 'a'])
+
+    def test_default_interval(self):
+        self.scheduler.start()
+        self.clock.advance(0)
+        self.polls[0][1].callback(None)
+        self.assertEqual(self.scheduler.cache_expires_at('a'), None)
+        self.assertEqual(self.scheduler.next_poll('a'), 1800)
+
+    def test_failed_poll(self):
+        self.scheduler.start()
+        self.clock.advance(0)
+        self.polls[0][1].errback(ValueError("Bad key"))
+        self.assertEqual(self.scheduler.next_poll('a'), 1800)
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+
+    def test_min_interval(self):
+        self.scheduler.start()
+        self.clock.advance(0)
+        self.polls[0][1].callback(0)
+        self.assertEqual(self.scheduler.next_poll('a'), 60)
+
+    def test_poll_now_joins_a_running_poll(self):
+        first = self.scheduler.poll_now('a')
+        second = self.scheduler.poll_now('a')
+        self.assertEqual(len(self.polls), 1)
+        self.assertTrue(self.scheduler.is_polling('a'))
+        results = []
+        first.addCallback(results.append)
+        second.addCallback(results.append)
+        self.polls[0][1].callback(300)
+        self.assertEqual(results, [300, 300])
+        self.assertFalse(self.scheduler.is_polling('a'))
+
+    def test_no_overlapping_polls(self):
+        self.scheduler.poll_now('a')
+        self.scheduler.start()
+        self.clock.advance(0)
+        self.assertEqual([key for key, d in self.polls], ['a', 'b'])
+
+    def test_stop(self):
+        self.scheduler.start()
+        self.scheduler.stop()
+        self.clock.advance(3600)
+        self.assertEqual(self.polls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Tests for the durable queue of outgoing messages, run with `python -m unittest test_spool`."""
+import os
+import shutil
+import tempfile
+import unittest
+from twisted.internet.task import Clock
+from spool import Spool
+
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'sovbot.spool')
+        self.clock = Clock()
+        self.spool = self.open()
+
+    def tearDown(self):
+        self.spool.close()
+        shutil.rmtree(self.directory)
+
+    def open(self, **kwargs):
+        return Spool(self.path, clock=self.clock, **kwargs)
+
+    def reopen(self, **kwargs):
+        self.spool.close()
+        self.spool = self.open(**kwargs)
+        return self.spool
+
+    def lines(self):
+        with open(self.path, 'rb') as f:
+            return f.read().splitlines()
+
+    def test_add(self):
+        added = self.spool.add([('room1', 'a'), ('room2', 'b')])
+        self.assertEqual(added, [(1, 'room1', 'a'), (2, 'room2', 'b')])
+        self.assertEqual(len(self.spool), 2)
+        self.assertEqual(self.spool.add([]), [])
+
+    def test_replay_after_restart(self):
+        self.spool.add([('room1', 'a'), ('room2', 'b'), ('room1', 'c')])
+        self.spool.ack(2)
+        spool = self.reopen()
+        self.assertEqual(list(spool.pending.iteritems()), [(1, ('room1', 'a')), (3, ('room1', 'c'))])
+        # Ids carry on from the last one used, so acknowledgements can't hit a reused id.
+        self.assertEqual(spool.add([('room1', 'd')]), [(4, 'room1', 'd')])
+
+    def test_acks_are_synced_later(self):
+        self.spool.add([('room1', 'a')])
+        self.spool.ack(1)
+        self.spool.ack(1)  # already acknowledged
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(1.0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(len(self.lines()), 2)
+
+    def test_compact(self):
+        spool = self.reopen(compact_after=2)
+        spool.add([('room1', 'a'), ('room1', 'b'), ('room1', 'c')])
+        spool.ack(1)
+        spool.sync()
+        self.assertEqual(len(self.lines()), 4)
+        spool.ack(2)
+        self.assertEqual(len(self.lines()), 1)
+        self.assertEqual(list(self.reopen().pending), [3])
+
+    def test_damaged_line(self):
+        self.spool.add([('room1', 'a'), ('room1', 'b')])
+        self.spool.close()
+        with open(self.path, 'ab') as f:
+            f.write('{"id": 3, "to": "roo')
+        self.assertEqual(list(self.reopen().pending), [1, 2])
+
+    def test_retain(self):
+        self.spool.add([('room1', 'a'), ('room2', 'b'), ('room1', 'c')])
+        self.assertEqual(self.spool.retain(set(['room1'])), [(2, 'room2', 'b')])
+        self.assertEqual(list(self.spool.pending), [1, 3])
+        self.assertEqual(list(self.reopen().pending), [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
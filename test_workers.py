@@ -0,0 +1,69 @@
+"""Tests for building notifications in worker processes, run with `trial test_workers`."""
+import os
+import shutil
+import tempfile
+from twisted.internet import reactor
+from twisted.trial import unittest
+from fake_api import FakeEveAPI, listen_fake_api
+from notification_set import NotificationSet
+from workers import WorkerPool, WorkerProcess, WorkerUnavailable
+
+KEY = {'keyid': '1', 'vcode': 'code'}
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.port = listen_fake_api(FakeEveAPI(20))
+        self.pool = WorkerPool(1, ['key'], {'selected_types': {'10': '', '86': ''},
+                                            'api_root': 'http://127.0.0.1:{}'.format(self.port.getHost().port),
+                                            'api_timeout': 10,
+                                            'api_parallelism': 2,
+                                            'api_chunk_size': 10,
+                                            'body_decoder_threads': 1,
+                                            'database_path': os.path.join(self.directory, 'sovbot.sqlite')})
+
+    def tearDown(self):
+        d = self.pool.stop()
+        d.addCallback(lambda _: self.port.stopListening())
+        d.addCallback(lambda _: shutil.rmtree(self.directory))
+        return d
+
+    def test_build(self):
+        d = self.pool.build('key', KEY)
+
+        def built(state):
+            self.assertEqual(self.pool.stats(), {'workers': 1, 'running': 1})
+            notification_set = NotificationSet({'10': '', '86': ''}, None, None, api=object(), name_cache=object())
+            notification_set.load_built_state(state)
+            self.assertTrue(notification_set._notifications)
+            self.assertTrue(all(n.type_id in (10, 86) for n in notification_set._notifications.itervalues()))
+
+        d.addCallback(built)
+        return d
+
+    def test_restart_after_exit(self):
+        d = self.pool.build('key', KEY)
+        d.addCallback(lambda _: self.pool._workers[0].transport.signalProcess('KILL'))
+        d.addCallback(lambda _: self.pool._workers[0].exited)
+        d.addCallback(lambda _: self.assertEqual(self.pool.stats(), {'workers': 1, 'running': 0}))
+        d.addCallback(lambda _: self.pool.build('key', KEY))
+        d.addCallback(lambda state: self.assertTrue(state))
+        return d
+
+    def test_failed_start(self):
+        self.patch(reactor, 'spawnProcess', lambda *args, **kwargs: self.fail_spawn())
+        d = self.pool.build('key', KEY)
+        self.assertEqual(self.pool.stats(), {'workers': 1, 'running': 0})
+        self.flushLoggedErrors(OSError)
+        return self.assertFailure(d, WorkerUnavailable)
+
+    def test_failed_connection(self):
+        self.patch(WorkerProcess, 'connectionMade', lambda worker: None)
+        d = self.pool.build('key', KEY)
+        self.assertEqual(self.pool.stats(), {'workers': 1, 'running': 0})
+        return self.assertFailure(d, WorkerUnavailable)
+
+    @staticmethod
+    def fail_spawn():
+        raise OSError("No such file")
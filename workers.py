@@ -0,0 +1,256 @@
+"""
+Worker processes for the fetch, parse and decode stages of the notifications task, so polling many API keys isn't
+limited to the one core the bot's process runs on.
+
+Each worker is a copy of this script started by a WorkerPool and talking AMP to the bot over its stdin and stdout. The
+keys are sharded between the workers, a worker fetches its keys' headers and texts and decodes their bodies, and it
+sends the built notifications back to the bot. Everything which decides what gets announced stays in the bot's
+process: merging copies reported by other keys, checking and recording sent notifications, collapsing attack alerts,
+formatting and sending. Workers only ever read sovbot.sqlite, to skip fetching texts which were already sent, so the bot
+remains the one place sent notifications are recorded.
+"""
+import cPickle
+import json
+import os
+import sys
+from functools import partial
+from twisted.internet import reactor, stdio
+from twisted.internet.address import _ProcessAddress
+from twisted.internet.defer import Deferred, DeferredList, fail
+from twisted.internet.error import ProcessExitedAlready
+from twisted.internet.interfaces import IProcessTransport
+from twisted.internet.protocol import ProcessProtocol
+from twisted.protocols import amp
+from twisted.python import log
+from twisted.python.components import proxyForInterface
+from eve_api import APIError, APITimeout, EveAPI
+from models import open_sovbot_db
+from notification_set import NotificationSet
+
+WORKER_SCRIPT = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+# Pickled sets are sent in pieces, since AMP values are limited to 64KB.
+CHUNK_SIZE = 60000
+
+
+class BuildNotifications(amp.Command):
+    """Asks a worker to run the headers, texts and build stages for a key. It sends the result as BuiltChunks first."""
+    arguments = [('request', amp.Integer()),
+                 ('key_id', amp.Unicode()),
+                 ('vcode', amp.Unicode()),
+                 ('character_id', amp.Unicode(optional=True))]
+    response = [('chunks', amp.Integer())]
+    errors = {APIError: 'API_ERROR', APITimeout: 'API_TIMEOUT'}
+
+
+class BuiltChunk(amp.Command):
+    """A piece of the pickled NotificationSet.built_state() a worker built for a BuildNotifications request."""
+    arguments = [('request', amp.Integer()),
+                 ('data', amp.String())]
+    response = []
+    requiresAnswer = False
+
+
+class Worker(amp.AMP):
+    """The worker's side of the connection, which builds notification sets with its own API client."""
+    def __init__(self, config):
+        amp.AMP.__init__(self)
+        self.selected_types = config['selected_types']
+        self.api = EveAPI(timeout=config['api_timeout'], max_connections=config['api_parallelism'],
+                          chunk_size=config['api_chunk_size'], root=config['api_root'])
+
+    @BuildNotifications.responder
+    def build_notifications(self, request, key_id, vcode, character_id=None):
+        notification_set = NotificationSet(self.selected_types, key_id, vcode, character_id, api=self.api)
+        d = notification_set.get_headers_xml()
+        d.addCallback(lambda _: notification_set.get_texts_xml())
+        d.addCallback(lambda _: notification_set.build_notifications())
+        d.addCallback(lambda _: self._send_state(request, notification_set.built_state()))
+        return d
+
+    def _send_state(self, request, state):
+        # AMP delivers boxes in order, so the chunks arrive before the response which counts them.
+        data = cPickle.dumps(state, cPickle.HIGHEST_PROTOCOL)
+        chunks = [data[start:start + CHUNK_SIZE] for start in xrange(0, len(data), CHUNK_SIZE)]
+        for chunk in chunks:
+            self.callRemote(BuiltChunk, request=request, data=chunk)
+        return {'chunks': len(chunks)}
+
+    def connectionLost(self, reason):
+        amp.AMP.connectionLost(self, reason)
+        # The bot has gone away.
+        reactor.stop()
+
+
+class WorkerUnavailable(Exception):
+    """Raised for notifications sent to a worker which isn't connected, e.g. because it failed to start or crashed."""
+
+
+class WorkerConnection(amp.AMP):
+    """The bot's side of the connection to a worker."""
+    def __init__(self):
+        amp.AMP.__init__(self)
+        self.connected = False
+        self.chunks = {}  # request -> pickled pieces received so far
+        self._requests = 0
+
+    def build(self, key):
+        """Returns a Deferred firing with the built state of the key's notifications."""
+        if not self.connected:
+            return fail(WorkerUnavailable("The worker for key {} isn't connected.".format(key['keyid'])))
+        self._requests += 1
+        request = self._requests
+        self.chunks[request] = []
+        d = self.callRemote(BuildNotifications, request=request, key_id=unicode(key['keyid']),
+                            vcode=unicode(key['vcode']),
+                            character_id=unicode(key['character_id']) if key.get('character_id') else None)
+
+        def received(response):
+            chunks = self.chunks.pop(request)
+            if len(chunks) != response['chunks']:
+                raise ValueError("Expected {expected} pieces of the built notifications, got {received}.".format(
+                    expected=response['chunks'], received=len(chunks)))
+            return cPickle.loads(''.join(chunks))
+
+        def failed(failure):
+            self.chunks.pop(request, None)
+            return failure
+
+        d.addCallbacks(received, failed)
+        return d
+
+    @BuiltChunk.responder
+    def built_chunk(self, request, data):
+        if request in self.chunks:
+            self.chunks[request].append(data)
+        return {}
+
+    def connectionMade(self):
+        amp.AMP.connectionMade(self)
+        self.connected = True
+
+    def connectionLost(self, reason):
+        self.connected = False
+        amp.AMP.connectionLost(self, reason)
+
+
+class _WorkerTransport(proxyForInterface(IProcessTransport, '_process')):
+    """A worker process's transport, with the addresses AMP asks its transport for, which process transports lack."""
+    def getPeer(self):
+        return _ProcessAddress()
+
+    def getHost(self):
+        return _ProcessAddress()
+
+
+class WorkerProcess(ProcessProtocol):
+    """
+    A worker process, running a WorkerConnection over its stdin and stdout. What the worker writes to stderr is its
+    log, which goes into the bot's. `lost` is called with the WorkerProcess once the process has gone.
+    """
+    def __init__(self, lost):
+        self.protocol = WorkerConnection()
+        self.lost = lost
+        self.exited = Deferred()  # fires once the worker process has gone
+
+    def build(self, key):
+        return self.protocol.build(key)
+
+    def connectionMade(self):
+        self.protocol.makeConnection(_WorkerTransport(self.transport))
+
+    def outReceived(self, data):
+        self.protocol.dataReceived(data)
+
+    def errReceived(self, data):
+        for line in data.splitlines():
+            log.msg("Worker {pid}: {line}".format(pid=self.transport.pid, line=line))
+
+    def processEnded(self, reason):
+        if self.protocol.connected:
+            self.protocol.connectionLost(reason)
+        self.lost(self)
+        self.exited.callback(None)
+
+
+class WorkerPool(object):
+    """
+    Builds notification sets in `size` worker processes. Each key label in `labels` always goes to the same worker, and
+    keys are spread over the workers in turn. `config` holds the settings the workers need: 'selected_types',
+    'api_root', 'api_timeout', 'api_parallelism', 'api_chunk_size', 'body_decoder_threads' and optionally
+    'database_path'. Workers are started the first time they're needed and started again after they exit, so a
+    crashed worker only fails the polls it was running.
+    """
+    def __init__(self, size, labels, config, reactor=reactor):
+        self.size = size
+        self.shards = dict((label, position % size) for position, label in enumerate(labels))
+        self.config = config
+        self.reactor = reactor
+        self._workers = [None] * size
+
+    def build(self, label, key):
+        """Returns a Deferred firing with NotificationSet.built_state() for a key, built by the worker owning it."""
+        return self._worker(self.shards[label]).build(key)
+
+    def stats(self):
+        return {'workers': self.size,
+                'running': sum(1 for worker in self._workers if worker is not None and worker.protocol.connected)}
+
+    def stop(self, timeout=5.0):
+        """
+        Closes the workers' stdin, which makes them exit, and kills any still running after `timeout` seconds. Returns
+        a Deferred firing once they've all gone, e.g. for a shutdown trigger.
+        """
+        workers = [worker for worker in self._workers if worker is not None]
+        for worker in workers:
+            worker.transport.loseConnection()
+
+        def kill():
+            for worker in workers:
+                if not worker.exited.called:
+                    log.msg("Killing a worker which didn't exit.")
+                    self._kill(worker)
+
+        kill_call = self.reactor.callLater(timeout, kill)
+        d = DeferredList([worker.exited for worker in workers])
+        d.addCallback(lambda _: kill_call.cancel() if kill_call.active() else None)
+        return d
+
+    def _worker(self, index):
+        worker = self._workers[index]
+        if worker is None:
+            log.msg("Starting worker {}...".format(index))
+            worker = WorkerProcess(partial(self._lost, index))
+            try:
+                self.reactor.spawnProcess(worker, sys.executable,
+                                          [sys.executable, WORKER_SCRIPT, json.dumps(self.config)], env=os.environ)
+            except Exception:
+                log.err(None, "Starting worker {} failed".format(index))
+                return worker
+            self._workers[index] = worker
+            if not worker.protocol.connected:
+                # The reactor logs what went wrong. Builds fail until the worker has gone, then it's started again.
+                log.msg("Connecting to worker {} failed.".format(index))
+                self._kill(worker)
+        return worker
+
+    @staticmethod
+    def _kill(worker):
+        try:
+            worker.transport.signalProcess('KILL')
+        except ProcessExitedAlready:
+            pass
+
+    def _lost(self, index, worker):
+        if self._workers[index] is worker:
+            log.msg("Worker {} exited.".format(index))
+            self._workers[index] = None
+
+
+if __name__ == "__main__":
+    # stdout carries the AMP connection, so the log goes to stderr, which the bot writes to its own log.
+    log.startLogging(sys.stderr)
+    config = json.loads(sys.argv[1])
+    open_sovbot_db(config.get('database_path'))
+    reactor.suggestThreadPoolSize(config['body_decoder_threads'])
+    stdio.StandardIO(Worker(config))
+    reactor.run()